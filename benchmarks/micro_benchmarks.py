@@ -0,0 +1,180 @@
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import getsize
+from resource import RUSAGE_SELF, getrusage
+from time import perf_counter
+from geopandas import read_file, read_parquet
+from pandas import DataFrame
+
+from scrapers.utilities.geo_functions import clip_to_extent, index_adm0, select_adm0
+from scrapers.utilities.pcode_functions import build_pcodes
+from scrapers.utilities.raster_functions import zonal_sums
+
+logger = logging.getLogger()
+
+
+def run_micro_benchmarks(world):
+    results = dict()
+    results["water_overlay"] = water_overlay(world)
+    results["pcodes"] = pcodes()
+    results["zonal_sums"] = zonal(world)
+    results["layer_formats"] = layer_formats(world)
+    return results
+
+
+def best_time(func, *args, repeat=3):
+    timings = list()
+    for _ in range(repeat):
+        start = perf_counter()
+        func(*args)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def peak_memory(func, *args, warm_up=None):
+    # run in a fresh process, after calling func on warm_up to do its imports and library setup,
+    # so that the increase in peak memory belongs to this call alone
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_peak_memory_in_worker, func, args, warm_up).result()
+
+
+def _peak_memory_in_worker(func, args, warm_up):
+    if warm_up is not None:
+        func(*warm_up)
+    before = getrusage(RUSAGE_SELF).ru_maxrss
+    func(*args)
+    return (getrusage(RUSAGE_SELF).ru_maxrss - before) / 1024
+
+
+def _world_file(world, resource_name):
+    for resource_id, path in world["files"].items():
+        if resource_id.endswith(f"/{resource_name}"):
+            return path
+    return None
+
+
+def water_overlay(world):
+    # overlay every country with the whole lakes layer, or only with the lakes within its extent
+    adm0_json = read_file(_world_file(world, "polbnda_int_1m_uncs.geojson"))
+    water_json = read_file(_world_file(world, "wrl_lake_1m_uncs.geojson"))
+    adm0_index = index_adm0(adm0_json)
+    # build the spatial index before timing, as boundaries does once for every country
+    water_json.sindex
+    country_lyrs = [select_adm0(adm0_json, adm0_index, [iso]) for iso in world["countries"]]
+
+    def full_overlay():
+        return [
+            country_adm0.overlay(water_json, how="difference") for country_adm0 in country_lyrs
+        ]
+
+    def clipped_overlay():
+        return [
+            country_adm0.overlay(clip_to_extent(water_json, country_adm0), how="difference")
+            for country_adm0 in country_lyrs
+        ]
+
+    # clipping the lakes must not change the land that is left in any country
+    mismatches = [
+        iso
+        for iso, full, clipped in zip(world["countries"], full_overlay(), clipped_overlay())
+        if not full.unary_union.equals(clipped.unary_union)
+    ]
+    if len(mismatches) > 0:
+        logger.error(f"Clipped water overlay differs for {', '.join(mismatches)}")
+
+    return {
+        "full": best_time(full_overlay),
+        "clipped": best_time(clipped_overlay),
+        "same_geometry": len(mismatches) == 0,
+    }
+
+
+def pcodes(rows=10000):
+    # build pcodes from numeric codes row by row, or with the vectorized builder
+    rng = np.random.default_rng(0)
+    boundary_lyr = DataFrame({"ADM0_PCODE": "AF", "ADM1_ID": rng.integers(1, rows, rows)})
+
+    def loop_pcodes():
+        lyr = boundary_lyr.copy()
+        numrows = len(str(len(lyr.index)))
+        for i, _ in lyr.iterrows():
+            lyr.loc[i, "ADM1_PCODE"] = lyr.loc[i, "ADM0_PCODE"] + str(
+                int(lyr.loc[i, "ADM1_ID"])
+            ).zfill(numrows)
+
+    def vectorized_pcodes():
+        build_pcodes(boundary_lyr["ADM0_PCODE"], boundary_lyr["ADM1_ID"])
+
+    return {
+        "rows": rows,
+        "loop": best_time(loop_pcodes, repeat=1),
+        "vectorized": best_time(vectorized_pcodes),
+    }
+
+
+def zonal(world):
+    # sum the synthetic WorldPop rasters with windowed reads, and with rasterstats if installed
+    adm1_json = read_file(_world_file(world, "polbnda_adm1_1m_ocha.geojson"))
+    rasters = list()
+    for iso in world["countries"]:
+        raster_file = _world_file(world, f"{iso.lower()}_ppp_2020_constrained.tif")
+        if raster_file:
+            rasters.append((adm1_json[adm1_json["alpha_3"] == iso], raster_file))
+    if len(rasters) == 0:
+        return dict()
+
+    def windowed():
+        for country_adm1, raster_file in rasters:
+            zonal_sums(country_adm1.geometry, raster_file)
+
+    results = {"windowed": best_time(windowed)}
+    try:
+        from rasterstats import zonal_stats
+    except ImportError:
+        logger.info("rasterstats is not installed - not comparing zonal sums")
+        return results
+
+    def whole_raster():
+        for country_adm1, raster_file in rasters:
+            zonal_stats(vectors=country_adm1, raster=raster_file, stats="sum")
+
+    results["rasterstats"] = best_time(whole_raster)
+    return results
+
+
+def layer_formats(world):
+    # read the large global layers from GeoJSON, and from GeoParquet as cached by parquet_layers
+    results = dict()
+    for resource_name in [
+        "polbnda_int_1m_uncs.geojson",
+        "polbnda_adm1_1m_ocha.geojson",
+        "wrl_lake_1m_uncs.geojson",
+    ]:
+        geojson_file = _world_file(world, resource_name)
+        parquet_file = geojson_file.replace(".geojson", ".parquet")
+        lyr = read_file(geojson_file)
+        lyr.to_parquet(parquet_file)
+        # one feature of the layer in each format, to warm up the readers with
+        warm_up_geojson = geojson_file.replace(".geojson", "-warm-up.geojson")
+        warm_up_parquet = parquet_file.replace(".parquet", "-warm-up.parquet")
+        lyr.iloc[:1].to_file(warm_up_geojson, driver="GeoJSON")
+        lyr.iloc[:1].to_parquet(warm_up_parquet)
+        results[resource_name] = {
+            "geojson": {
+                "size_mb": getsize(geojson_file) / 1024 ** 2,
+                "read": best_time(read_file, geojson_file),
+                "peak_memory_mb": peak_memory(
+                    read_file, geojson_file, warm_up=(warm_up_geojson,)
+                ),
+            },
+            "parquet": {
+                "size_mb": getsize(parquet_file) / 1024 ** 2,
+                "read": best_time(read_parquet, parquet_file),
+                "peak_memory_mb": peak_memory(
+                    read_parquet, parquet_file, warm_up=(warm_up_parquet,)
+                ),
+            },
+        }
+    return results
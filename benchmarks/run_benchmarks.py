@@ -0,0 +1,290 @@
+import argparse
+import logging
+import platform
+import re
+from contextlib import ExitStack, contextmanager
+from glob import glob
+from hashlib import sha256
+from json import dump, load
+from os import chdir, getcwd, makedirs
+from os.path import basename, dirname, exists, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import mock
+
+from hdx.location.country import Country
+from hdx.utilities.easy_logging import setup_logging
+from hdx.utilities.loader import load_yaml
+from benchmarks.micro_benchmarks import run_micro_benchmarks
+from benchmarks.synthetic_data import generate_world
+from scrapers.boundaries import update_boundaries
+from scrapers.health_facilities import update_health_facilities
+from scrapers.main import boundaries_layers, load_global_layers
+from scrapers.population import update_population
+from scrapers.utilities.hdx_functions import read_vector
+from scrapers.utilities.report_functions import (
+    enable_report,
+    pop_report_stages,
+    set_report_context,
+    summarize_stages,
+)
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+root_folder = dirname(dirname(__file__))
+results_folder = join(root_folder, "benchmarks", "results")
+
+scales = {
+    "small": {
+        "countries": 4,
+        "vertices": 250,
+        "admin1": 8,
+        "lakes": 50,
+        "raster_size": 512,
+        "points": 2000,
+    },
+    "medium": {
+        "countries": 9,
+        "vertices": 2000,
+        "admin1": 20,
+        "lakes": 500,
+        "raster_size": 2048,
+        "points": 20000,
+    },
+    "large": {
+        "countries": 16,
+        "vertices": 10000,
+        "admin1": 60,
+        "lakes": 5000,
+        "raster_size": 6144,
+        "points": 150000,
+    },
+}
+scrapers = ["boundaries", "population", "health_facilities"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-sc", "--scales", default="small,medium", help="Which scales to run")
+    parser.add_argument(
+        "-wo", "--workers", default="1", help="Number of processes for admin1 boundaries"
+    )
+    parser.add_argument("-mi", "--micro", default="true", help="Run micro benchmarks (true/false)")
+    args = parser.parse_args()
+    return args
+
+
+class BenchmarkResource(dict):
+    def __init__(self, data, uploads):
+        super().__init__(data)
+        self.uploads = uploads
+        self.file_to_upload = None
+
+    def get_file_type(self):
+        return self["format"].lower()
+
+    def set_file_to_upload(self, file_to_upload):
+        self.file_to_upload = file_to_upload
+
+    def update_in_hdx(self):
+        with open(self.file_to_upload, "rb") as f:
+            self.uploads[self["name"]] = sha256(f.read()).hexdigest()
+
+
+class BenchmarkDownloader:
+    def __init__(self, world):
+        self.world = world
+
+    def get_tabular_rows(self, url, dict_form=True):
+        headers, rows = self.world["tables"][url]
+        return list(headers), (dict(row) for row in rows)
+
+
+@contextmanager
+def stubbed_hdx(world):
+    # serve resources from the synthetic world instead of HDX, for every scraper module
+    uploads = dict()
+
+    def find_resource(dataset_name, file_type=None, kw=None):
+        resources = world["resources"].get(dataset_name, [])
+        resources = [BenchmarkResource(r, uploads) for r in resources]
+        if file_type:
+            resources = [r for r in resources if r.get_file_type() == file_type.lower()]
+        if kw:
+            resources = [r for r in resources if re.match(f".*{kw}.*", r["name"], re.IGNORECASE)]
+        if len(resources) == 0:
+            return None
+        return resources
+
+    def download_unzip_read_data(
+        resource, file_type=None, unzip=False, read=False, columns=None, bbox=None, chunk_size=None
+    ):
+        path = world["files"][resource["id"]]
+        if read:
+            return read_vector(path, columns=columns, bbox=bbox, chunk_size=chunk_size)
+        return [path]
+
+    def prefetch_resource(resource):
+        return world["files"][resource["id"]]
+
+    with ExitStack() as stack:
+        for module in ["main", "boundaries", "population", "health_facilities"]:
+            module = f"scrapers.{module}"
+            stack.enter_context(mock.patch(f"{module}.find_resource", find_resource))
+            stack.enter_context(
+                mock.patch(f"{module}.download_unzip_read_data", download_unzip_read_data)
+            )
+            if module != "scrapers.main":
+                stack.enter_context(mock.patch(f"{module}.prefetch_resource", prefetch_resource))
+        yield uploads
+
+
+def benchmark_configuration(world):
+    configuration = load_yaml(join(root_folder, "config", "project_configuration.yml"))
+    countries = world["countries"]
+    configuration["adm0"] = {"benchmark": countries}
+    configuration["adm1"] = {"benchmark": countries}
+    configuration["HRPs"] = countries[::2]
+    configuration["boundaries"]["dataset_exceptions"] = {}
+    configuration["boundaries"]["resource_exceptions"] = {}
+    configuration["population"]["resource_exceptions"] = {}
+    configuration["health_facilities"]["dataset_exceptions"] = {}
+    configuration["regional"]["iso3"] = configuration["regional"]["iso3_header"]
+    configuration["regional"]["region"] = configuration["regional"]["region_header"]
+    return configuration
+
+
+def run_scrapers(world, workers):
+    configuration = benchmark_configuration(world)
+    downloader = BenchmarkDownloader(world)
+    timings = dict()
+    with stubbed_hdx(world) as uploads:
+        set_report_context(scraper="global_layers", country=None)
+        start = perf_counter()
+        global_layers = load_global_layers(
+            configuration, "hdx", None, ["polbnda_adm1"] + boundaries_layers
+        )
+        timings["global_layers"] = perf_counter() - start
+        adm1_json = global_layers["polbnda_adm1"]
+        temp_folder = join(world["folder"], "outputs")
+        makedirs(temp_folder, exist_ok=True)
+
+        for scraper in scrapers:
+            logger.info(f"Running {scraper} benchmark")
+            set_report_context(scraper=scraper, country=None)
+            start = perf_counter()
+            if scraper == "boundaries":
+                update_boundaries(
+                    configuration,
+                    downloader,
+                    None,
+                    temp_folder,
+                    global_layers,
+                    "hdx",
+                    False,
+                    ["benchmark"],
+                    world["countries"],
+                    workers,
+                )
+            if scraper == "population":
+                update_population(
+                    configuration,
+                    downloader,
+                    world["countries"],
+                    adm1_json,
+                    temp_folder,
+                    world["countries"],
+                    workers,
+                )
+            if scraper == "health_facilities":
+                update_health_facilities(
+                    configuration,
+                    downloader,
+                    world["countries"],
+                    adm1_json,
+                    temp_folder,
+                    world["countries"],
+                )
+            timings[scraper] = perf_counter() - start
+
+    # hash everything the scrapers publish so that changes in outputs show up next to timings
+    outputs = dict(uploads)
+    for saved_file in sorted(glob(join("saved_outputs", "*"))):
+        with open(saved_file, "rb") as f:
+            outputs[basename(saved_file)] = sha256(f.read()).hexdigest()
+    return timings, outputs
+
+
+def run_scale(scale, workers, micro):
+    with TemporaryDirectory() as folder:
+        world = generate_world(folder, **scales[scale])
+        cwd = getcwd()
+        # boundaries writes its manifest and lookups relative to the working directory
+        chdir(folder)
+        makedirs("saved_outputs")
+        try:
+            pop_report_stages()
+            timings, outputs = run_scrapers(world, workers)
+            stages = summarize_stages(pop_report_stages())
+        finally:
+            chdir(cwd)
+        results = {
+            "scale": scales[scale],
+            "workers": workers,
+            "environment": {"python": platform.python_version(), "machine": platform.machine()},
+            "timings": _round(timings),
+            "stages": _round(stages),
+            "outputs": outputs,
+        }
+        if micro:
+            results["micro"] = _round(run_micro_benchmarks(world))
+    return results
+
+
+def compare_results(scale, previous, results):
+    for scraper, timing in results["timings"].items():
+        old_timing = previous.get("timings", {}).get(scraper)
+        if not old_timing:
+            logger.info(f"{scale} {scraper}: {timing:.3f}s")
+            continue
+        change = (timing - old_timing) / old_timing
+        logger.info(f"{scale} {scraper}: {timing:.3f}s (was {old_timing:.3f}s, {change:+.0%})")
+    for output, output_hash in results["outputs"].items():
+        if previous.get("outputs", {}).get(output, output_hash) != output_hash:
+            logger.warning(f"{scale} output {output} has changed")
+
+
+def _round(values):
+    if isinstance(values, dict):
+        return {key: _round(value) for key, value in values.items()}
+    if isinstance(values, float):
+        return round(values, 3)
+    return values
+
+
+def main(scales_to_run, workers, micro):
+    Country.countriesdata(use_live=False)
+    enable_report()
+    makedirs(results_folder, exist_ok=True)
+    for scale in scales_to_run:
+        if scale not in scales:
+            logger.error(f"Unknown benchmark scale {scale}")
+            continue
+        logger.info(f"Running {scale} benchmarks")
+        results = run_scale(scale, workers, micro)
+
+        results_file = join(results_folder, f"{scale}.json")
+        previous = dict()
+        if exists(results_file):
+            with open(results_file) as f:
+                previous = load(f)
+        compare_results(scale, previous, results)
+        with open(results_file, "w") as f:
+            dump(results, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args.scales.split(","), int(args.workers), args.micro.lower() == "true")
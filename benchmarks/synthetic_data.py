@@ -0,0 +1,284 @@
+import logging
+import numpy as np
+import rasterio
+from math import ceil, cos, pi, sin, sqrt
+from os import makedirs
+from os.path import join
+from geopandas import GeoDataFrame
+from rasterio.transform import from_bounds
+from shapely.geometry import LineString, Point, Polygon
+from slugify import slugify
+
+from hdx.location.country import Country
+
+logger = logging.getLogger()
+
+# countries with COD-AB style boundaries, in the order they are added to the synthetic world
+iso3s = [
+    "AFG", "BDI", "BFA", "CAF", "CMR", "COD", "COL", "ETH", "GTM", "HTI", "IRQ", "LBY",
+    "MLI", "NER", "NGA", "PSE", "SDN", "SLV", "SOM", "SSD", "TCD", "VEN", "YEM", "MOZ",
+]
+
+boundaries_dataset = "unmap-international-boundaries-geojson"
+population_dataset = "admin-1-population-statistics-for-data-explorers"
+health_dataset = "admin-1-health-facilities-for-data-explorers"
+regional_dataset = "unocha-office-locations"
+
+cell_size = 4
+
+
+def generate_world(
+    folder,
+    countries=4,
+    vertices=250,
+    admin1=8,
+    lakes=50,
+    raster_size=512,
+    points=2000,
+    seed=0,
+):
+    rng = np.random.default_rng(seed)
+    world = {
+        "folder": folder,
+        "countries": iso3s[:countries],
+        "resources": dict(),
+        "files": dict(),
+        "tables": dict(),
+    }
+    columns = ceil(sqrt(countries))
+
+    adm0_rows = list()
+    adm1_rows = list()
+    for i, iso in enumerate(world["countries"]):
+        center = (-20 + (i % columns) * cell_size, -10 + (i // columns) * cell_size)
+        iso2 = Country.get_iso2_from_iso3(iso)
+        name = Country.get_country_name_from_iso3(iso)
+
+        # the UN and COD-AB outlines differ slightly so that harmonizing leaves slivers
+        un_outline = _outline(rng, center, vertices)
+        cod_outline = _outline(rng, center, vertices)
+        adm0_rows.append(
+            {
+                "ISO_3": iso,
+                "Color_Code": iso,
+                "STATUS": "Member State",
+                "Terr_ID": i,
+                "Terr_Name": name,
+                "geometry": Polygon(un_outline),
+            }
+        )
+
+        cod_rows = list()
+        width = len(str(admin1))
+        for unit, (un_wedge, cod_wedge) in enumerate(
+            zip(_wedges(center, un_outline, admin1), _wedges(center, cod_outline, admin1))
+        ):
+            pcode = iso2 + str(unit + 1).zfill(width)
+            unit_name = f"Région {name} {unit + 1}"
+            adm1_rows.append(
+                {
+                    "alpha_3": iso,
+                    "ADM0_REF": name,
+                    "ADM0_PCODE": iso2,
+                    "ADM1_REF": unit_name,
+                    "ADM1_PCODE": pcode,
+                    "geometry": un_wedge,
+                }
+            )
+            # alternate between text pcodes and numeric codes that have to be built into pcodes
+            if i % 2 == 0:
+                cod_rows.append({"ADM1_EN": unit_name, "ADM1_PCODE": pcode, "geometry": cod_wedge})
+            else:
+                cod_rows.append({"ADM1_EN": unit_name, "ADM1_ID": unit + 1, "geometry": cod_wedge})
+        cod_lyr = GeoDataFrame(cod_rows, crs="EPSG:4326")
+        _add_resource(
+            world,
+            f"cod-ab-{iso.lower()}",
+            f"{iso.lower()}_adm_20220101_shp.zip",
+            "SHP",
+            _write_shapefile(cod_lyr, folder, f"{iso.lower()}_admbnda_adm1_20220101"),
+        )
+
+        bounds = Polygon(un_outline).bounds
+        if i % 2 == 0:
+            pop_rows = [
+                {"ADM1_PCODE": row["ADM1_PCODE"], "T": int(rng.integers(1000, 1000000))}
+                for row in adm1_rows
+                if row["alpha_3"] == iso
+            ]
+            _add_table(
+                world, f"cod-ps-{iso.lower()}", f"{iso.lower()}_admpop_adm1_2022.csv", pop_rows
+            )
+        else:
+            raster_name = f"{iso.lower()}_ppp_2020_constrained.tif"
+            _add_resource(
+                world,
+                f"worldpop-population-counts-for-{slugify(name)}",
+                raster_name,
+                "GeoTIFF",
+                _write_raster(rng, folder, raster_name, bounds, raster_size),
+            )
+
+        facilities = GeoDataFrame(
+            {
+                "osm_id": rng.integers(1, 10 ** 9, points),
+                "name": [f"Health facility {n}" for n in range(points)],
+                "amenity": rng.choice(["clinic", "hospital", "doctors", "pharmacy"], points),
+                "healthcare": rng.choice(["clinic", "hospital", "doctor", "pharmacy"], points),
+            },
+            geometry=[
+                Point(x, y)
+                for x, y in zip(
+                    rng.uniform(bounds[0] - 0.5, bounds[2] + 0.5, points),
+                    rng.uniform(bounds[1] - 0.5, bounds[3] + 0.5, points),
+                )
+            ],
+            crs="EPSG:4326",
+        )
+        facilities_name = f"hotosm_{iso.lower()}_health_facilities_points"
+        _add_resource(
+            world,
+            f"hotosm_{iso.lower()}_health_facilities",
+            f"{facilities_name}_shp.zip",
+            "SHP",
+            _write_shapefile(facilities, folder, facilities_name),
+        )
+
+    adm0_lyr = GeoDataFrame(adm0_rows, crs="EPSG:4326")
+    adm0_lines = GeoDataFrame(
+        {"BDY_CNT01": adm0_lyr["ISO_3"], "BDY_CNT02": adm0_lyr["ISO_3"]},
+        geometry=[LineString(g.exterior.coords) for g in adm0_lyr.geometry],
+        crs="EPSG:4326",
+    )
+    adm0_points = GeoDataFrame(
+        {"ISO_3": adm0_lyr["ISO_3"]}, geometry=adm0_lyr.representative_point(), crs="EPSG:4326"
+    )
+    adm0_lr_lyr = adm0_lyr.copy()
+    adm0_lr_lyr["geometry"] = adm0_lyr.simplify(0.05)
+    minx, miny, maxx, maxy = adm0_lyr.total_bounds
+    water_lyr = GeoDataFrame(
+        {"name": [f"Lake {n}" for n in range(lakes)]},
+        geometry=[
+            Point(x, y).buffer(r, resolution=8)
+            for x, y, r in zip(
+                rng.uniform(minx, maxx, lakes),
+                rng.uniform(miny, maxy, lakes),
+                rng.uniform(0.02, 0.3, lakes),
+            )
+        ],
+        crs="EPSG:4326",
+    )
+    adm1_lyr = GeoDataFrame(adm1_rows, crs="EPSG:4326")
+    adm1_points = adm1_lyr.copy()
+    adm1_points["geometry"] = adm1_lyr.representative_point()
+
+    global_layers = {
+        "polbnda_int_1m_uncs.geojson": adm0_lyr,
+        "polbnda_int_15m_uncs.geojson": adm0_lr_lyr,
+        "polbndl_int_1m_uncs.geojson": adm0_lines,
+        "polbndp_int_1m_uncs.geojson": adm0_points,
+        "wrl_lake_1m_uncs.geojson": water_lyr,
+        "polbnda_adm1_1m_ocha.geojson": adm1_lyr,
+        "polbndp_adm1_1m_ocha.geojson": adm1_points,
+    }
+    for resource_name, lyr in global_layers.items():
+        path = join(folder, resource_name)
+        lyr.to_file(path, driver="GeoJSON")
+        _add_resource(world, boundaries_dataset, resource_name, "GeoJSON", path)
+
+    regional_rows = [
+        {"ISO3": iso, "Regional_office": ["ROAP", "ROWCA", "ROLAC", "ROMENA"][i % 4]}
+        for i, iso in enumerate(world["countries"])
+    ]
+    _add_table(world, regional_dataset, "ocha-offices.xlsx", regional_rows, "XLSX")
+
+    # the published csvs start with the same countries so that every row is replaced
+    adm1_table = adm1_lyr.drop(columns="geometry").sort_values(by=["ADM1_PCODE"])
+    _add_table(
+        world,
+        population_dataset,
+        "population_by_adm1.csv",
+        adm1_table.assign(Population="").to_dict("records"),
+    )
+    _add_table(
+        world,
+        health_dataset,
+        "health_facilities_by_adm1.csv",
+        adm1_table.assign(Health_Facilities="").to_dict("records"),
+    )
+
+    logger.info(f"Generated synthetic world with {countries} countries in {folder}")
+    return world
+
+
+def _outline(rng, center, vertices):
+    angles = np.linspace(0, 2 * pi, vertices, endpoint=False)
+    # smooth noise, so that neighbouring vertices are close like a real border
+    noise = rng.normal(0, 0.08, vertices + 10)
+    noise = np.convolve(noise, np.ones(10) / 10, mode="valid")[:vertices]
+    radii = cell_size * 0.4 * (1 + noise)
+    return [(center[0] + r * cos(a), center[1] + r * sin(a)) for a, r in zip(angles, radii)]
+
+
+def _wedges(center, outline, count):
+    # split the outline into wedges around the center that share their edges exactly
+    breaks = [round(n * len(outline) / count) for n in range(count)] + [len(outline)]
+    ring = outline + outline[:1]
+    return [
+        Polygon([center] + ring[start:stop + 1]) for start, stop in zip(breaks[:-1], breaks[1:])
+    ]
+
+
+def _add_resource(world, dataset_name, resource_name, file_type, path):
+    resource_id = f"{dataset_name}/{resource_name}"
+    resource = {
+        "id": resource_id,
+        "name": resource_name,
+        "format": file_type,
+        "url": f"https://data.example.org/{resource_id}",
+        "last_modified": "2022-01-01T00:00:00",
+    }
+    world["resources"].setdefault(dataset_name, list()).append(resource)
+    world["files"][resource_id] = path
+    return resource
+
+
+def _add_table(world, dataset_name, resource_name, rows, file_type="CSV"):
+    # tables are read through the downloader rather than from a file
+    resource = _add_resource(world, dataset_name, resource_name, file_type, None)
+    world["tables"][resource["url"]] = (list(rows[0]), rows)
+
+
+def _write_shapefile(lyr, folder, name):
+    shp_folder = join(folder, name)
+    makedirs(shp_folder, exist_ok=True)
+    path = join(shp_folder, f"{name}.shp")
+    lyr.to_file(path)
+    return path
+
+
+def _write_raster(rng, folder, name, bounds, size):
+    path = join(folder, name)
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=size,
+        height=size,
+        count=1,
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=from_bounds(*bounds, size, size),
+        nodata=-99999,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+    ) as dst:
+        for row in range(0, size, 256):
+            height = min(256, size - row)
+            data = rng.gamma(0.5, 20, (height, size)).astype("float32")
+            # constrained rasters only have values in settled cells
+            data[rng.random((height, size)) < 0.7] = -99999
+            dst.write(data, 1, window=((row, row + height), (0, size)))
+    return path
@@ -11,6 +11,9 @@ from hdx.utilities.downloader import Download
 from hdx.utilities.easy_logging import setup_logging
 from hdx.utilities.path import temp_dir
 from scrapers.main import get_indicators
+from scrapers.utilities.cache_functions import setup_cache
+from scrapers.utilities.hdx_functions import set_rate_limit
+from scrapers.utilities.report_functions import enable_report, write_report
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -31,6 +34,12 @@ def parse_args():
     parser.add_argument("-ut", "--update_tilesets", default=None, help="Update mapbox tilesets (true/false)")
     parser.add_argument("-ma", "--mapbox_auth", default=None, help="Credentials for accessing MapBox data")
     parser.add_argument("-so", "--data_source", default="HDX", help="Where to pull UN boundaries from")
+    parser.add_argument("-wo", "--workers", default=None, help="Number of processes for admin1 boundaries")
+    parser.add_argument("-cd", "--cache_dir", default=None, help="Folder to cache downloaded resources in")
+    parser.add_argument("-of", "--offline", default=None, help="Only use cached resources (true/false)")
+    parser.add_argument("-in", "--incremental", default=None, help="Skip unchanged admin1 boundaries (true/false)")
+    parser.add_argument("-rr", "--run_report", default=None, help="File to write stage timings to")
+    parser.add_argument("-sw", "--scraper_workers", default=None, help="Number of scrapers to run at the same time")
     args = parser.parse_args()
     return args
 
@@ -42,12 +51,28 @@ def main(
     mapbox_auth,
     data_source,
     update_tilesets,
+    workers,
+    cache_dir,
+    offline,
+    incremental,
+    run_report,
+    scraper_workers,
     **ignore,
 ):
     logger.info(f"##### hdx-viz-data-inputs ####")
+    if run_report:
+        enable_report()
     configuration = Configuration.read()
+    setup_cache(
+        cache_dir,
+        configuration["download_cache"]["max_size_gb"],
+        offline,
+        configuration["download_cache"]["parquet_layers"],
+    )
+    rate_limit = {"calls": 1, "period": 0.1}
+    set_rate_limit(rate_limit)
     with temp_dir() as temp_folder:
-        with Download(rate_limit={"calls": 1, "period": 0.1}) as downloader:
+        with Download(rate_limit=rate_limit) as downloader:
             if scrapers_to_run:
                 logger.info(f"Updating only scrapers: {scrapers_to_run}")
             if visualizations:
@@ -62,7 +87,12 @@ def main(
                 scrapers_to_run,
                 countries,
                 visualizations,
+                workers,
+                incremental,
+                scraper_workers,
             )
+    if run_report:
+        write_report(run_report)
 
 
 if __name__ == "__main__":
@@ -112,6 +142,34 @@ if __name__ == "__main__":
     if data_source not in ["hdx", "mapbox"]:
         logger.info("Unknown data source, defaulting to HDX")
         data_source = "hdx"
+    workers = args.workers
+    if workers is None:
+        workers = getenv("WORKERS", "1")
+    workers = int(workers)
+    cache_dir = args.cache_dir
+    if cache_dir is None:
+        cache_dir = getenv("CACHE_DIR", None)
+    offline = args.offline
+    if offline is None:
+        offline = getenv("OFFLINE", "false")
+    if offline.lower() == "true":
+        offline = True
+    else:
+        offline = False
+    incremental = args.incremental
+    if incremental is None:
+        incremental = getenv("INCREMENTAL", "false")
+    if incremental.lower() == "true":
+        incremental = True
+    else:
+        incremental = False
+    run_report = args.run_report
+    if run_report is None:
+        run_report = getenv("RUN_REPORT", None)
+    scraper_workers = args.scraper_workers
+    if scraper_workers is None:
+        scraper_workers = getenv("SCRAPER_WORKERS", "1")
+    scraper_workers = int(scraper_workers)
     facade(
         main,
         hdx_key=hdx_key,
@@ -127,4 +185,10 @@ if __name__ == "__main__":
         update_tilesets=update_tilesets,
         mapbox_auth=mapbox_auth,
         data_source=data_source,
+        workers=workers,
+        cache_dir=cache_dir,
+        offline=offline,
+        incremental=incremental,
+        run_report=run_report,
+        scraper_workers=scraper_workers,
     )
@@ -1,7 +1,8 @@
 import logging
 import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from os.path import join
-from unicodedata import normalize
 from geopandas import GeoDataFrame, read_file
 from pandas import merge
 from pandas.api.types import is_numeric_dtype
@@ -10,23 +11,69 @@ from topojson import Topology
 
 from hdx.data.hdxobject import HDXError
 from hdx.location.country import Country
-from scrapers.utilities.hdx_functions import download_unzip_read_data, find_resource
+from hdx.utilities.downloader import DownloadError
+from scrapers.utilities.cache_functions import (
+    get_cache_settings,
+    read_cached_layer,
+    set_cache_settings,
+    write_cached_layer,
+)
+from scrapers.utilities.geo_functions import (
+    assign_slivers,
+    clip_to_extent,
+    geometry_hash,
+    index_adm0,
+    layer_hash,
+    select_adm0,
+    without_sindex,
+)
+from scrapers.utilities.hdx_functions import (
+    download_unzip_read_data,
+    find_resource,
+    get_tabular_rows,
+    prefetch,
+    prefetch_resource,
+    remove_unzipped_download,
+    zip_member_name,
+)
 from scrapers.utilities.json_functions import *
 from scrapers.utilities.mapbox_functions import *
+from scrapers.utilities.pcode_functions import (
+    build_pcodes,
+    build_sequential_pcodes,
+    find_attribute_fields,
+    normalize_names,
+)
+from scrapers.utilities.report_functions import (
+    add_report_stages,
+    enable_report,
+    pop_report_stages,
+    report_enabled,
+    set_report_context,
+    stage,
+)
 
 logger = logging.getLogger()
 
+simplify_params = {
+    "epsilon": 0.0075,
+    "simplify_algorithm": "dp",
+    "prevent_oversimplify": True,
+}
+
 
 def update_boundaries(
     configuration,
     downloader,
     mapbox_auth,
     temp_folder,
-    adm1_json,
+    global_layers,
     data_source,
     update_tilesets,
     visualizations,
     countries=None,
+    workers=1,
+    incremental=False,
 ):
     exceptions = configuration["boundaries"].get("dataset_exceptions")
     if not exceptions:
@@ -51,267 +98,92 @@ def update_boundaries(
         countries = list(countries)
         countries.sort()
 
-    # download all datasets that are needed
-    if data_source == "hdx":
-        resource = find_resource(
-            configuration["boundaries"]["dataset"], "geojson", kw="polbnda_int_1m"
-        )
-        if not resource:
-            return
-        adm0_json = download_unzip_read_data(
-            resource[0], file_type="geojson", unzip=False, read=True
-        )
-
-        resource = find_resource(
-            configuration["boundaries"]["dataset"], "geojson", kw="polbnda_int_15m"
-        )
-        if not resource:
-            return
-        adm0_json_lr = download_unzip_read_data(
-            resource[0], file_type="geojson", unzip=False, read=True
-        )
+    # global layers are downloaded together before any scraper runs
+    adm1_json = global_layers["polbnda_adm1"]
+    adm0_json = global_layers["polbnda_int_1m"]
+    adm0_json_lr = global_layers["polbnda_int_15m"]
+    adm0_l_json = global_layers["polbndl_int"]
+    adm0_c_json = global_layers["polbndp_int"]
+    water_json = global_layers["lake"]
 
-        resource = find_resource(
-            configuration["boundaries"]["dataset"], "geojson", kw="polbndl_int"
-        )
-        if not resource:
-            return
-        adm0_l_json = download_unzip_read_data(
-            resource[0], file_type="geojson", unzip=False, read=True
-        )
-
-        resource = find_resource(
-            configuration["boundaries"]["dataset"], "geojson", kw="polbndp_int"
-        )
-        if not resource:
-            return
-        adm0_c_json = download_unzip_read_data(
-            resource[0], file_type="geojson", unzip=False, read=True
-        )
-
-        resource = find_resource(
-            configuration["boundaries"]["dataset"], "geojson", kw="lake"
-        )
-        if not resource:
-            return
-        water_json = download_unzip_read_data(
-            resource[0], file_type="geojson", unzip=False, read=True
-        )
-
-    if data_source == "mapbox":
-        adm0_json = download_from_mapbox(
-            configuration["mapbox"]["global"]["polbnda_int_1m"], mapbox_auth
-        )
-        if isinstance(adm0_json, type(None)):
-            return
-
-        adm0_json_lr = download_from_mapbox(
-            configuration["mapbox"]["global"]["polbnda_int_15m"], mapbox_auth
-        )
-        if isinstance(adm0_json_lr, type(None)):
-            return
-
-        adm0_l_json = download_from_mapbox(
-            configuration["mapbox"]["global"]["polbndl_int"], mapbox_auth
-        )
-        if isinstance(adm0_l_json, type(None)):
-            return
-
-        adm0_c_json = download_from_mapbox(
-            configuration["mapbox"]["global"]["polbndp_int"], mapbox_auth
-        )
-        if isinstance(adm0_c_json, type(None)):
-            return
-
-        water_json = download_from_mapbox(
-            configuration["mapbox"]["global"]["lake"], mapbox_auth
-        )
-        if isinstance(water_json, type(None)):
-            return
+    adm0_index = index_adm0(adm0_json)
+    adm0_lr_index = index_adm0(adm0_json_lr)
 
     req_fields = ["alpha_3", "ADM0_REF", "ADM0_PCODE", "ADM1_REF", "ADM1_PCODE"]
+    manifest_file = join("saved_outputs", "boundaries-manifest.json")
+    manifest = dict()
+    if incremental:
+        manifest = read_json(manifest_file)
+    process_countries = list()
+    boundary_resources = dict()
     for iso in countries:
         if iso in configuration["boundaries"]["do_not_process"]:
             logger.warning(f"Not processing {iso} for now")
             continue
 
-        logger.info(f"Processing admin1 boundaries for {iso}")
-
-        # select single country boundary (including disputed areas), cut out water, and dissolve
-        country_adm0 = adm0_json.copy(deep=True)
-        country_adm0 = country_adm0.loc[
-            (country_adm0["ISO_3"] == iso) | (country_adm0["Color_Code"] == iso)
-        ]
-        country_adm0 = country_adm0.overlay(water_json, how="difference")
-        country_adm0 = country_adm0.dissolve()
-        country_adm0 = drop_fields(country_adm0, ["ISO_3"])
-        country_adm0["ISO_3"] = iso
-        if not country_adm0.crs:
-            country_adm0 = country_adm0.set_crs(crs="EPSG:4326")
-
-        # find the correct admin boundary resource
-        dataset_name = exceptions.get(iso)
-        resource_name = resource_exceptions.get(iso)
-        if not resource_name:
-            resource_name = "adm"
-        boundary_resource = None
-        if dataset_name:
-            boundary_resource = find_resource(dataset_name, "SHP", kw=resource_name)
-        if not boundary_resource:
-            boundary_resource = find_resource(
-                f"cod-em-{iso.lower()}", "SHP", kw=resource_name
-            )
-        if not boundary_resource:
-            boundary_resource = find_resource(
-                f"cod-ab-{iso.lower()}", "SHP", kw=resource_name
-            )
-        if not boundary_resource:
-            logger.error(f"Could not find boundary dataset for {iso}")
-            continue
-
-        if len(boundary_resource) > 1:
-            name_match = [
-                bool(re.match(".*adm(in)?(\s)?(0)?1.*", r["name"], re.IGNORECASE))
-                for r in boundary_resource
-            ]
-            boundary_resource = [
-                boundary_resource[i]
-                for i in range(len(boundary_resource))
-                if name_match[i]
-            ]
-
-            if len(boundary_resource) != 1:
-                logger.error(f"Could not distinguish between resources for {iso}")
-                continue
-
-        # find the correct admin boundary shapefile in the downloaded zip
-        boundary_shp = download_unzip_read_data(boundary_resource[0], "shp", unzip=True)
-        if not boundary_shp:
+        boundary_resource = find_boundary_resource(iso, exceptions, resource_exceptions)
+        if isinstance(boundary_resource, type(None)):
             continue
 
-        if len(boundary_shp) > 1:
-            name_match = [
-                bool(re.match(".*admbnda.*adm(in)?(0)?1.*", b, re.IGNORECASE))
-                for b in boundary_shp
-            ]
-            if any(name_match):
-                boundary_shp = [
-                    boundary_shp[i] for i in range(len(boundary_shp)) if name_match[i]
-                ]
-
-        if len(boundary_shp) > 1:
-            simp_match = [
-                bool(re.match(".*simplified.*", b, re.IGNORECASE)) for b in boundary_shp
-            ]
-            if any(simp_match):
-                boundary_shp = [
-                    boundary_shp[i]
-                    for i in range(len(boundary_shp))
-                    if not simp_match[i]
-                ]
-
-        if len(boundary_shp) != 1:
-            logger.error(
-                f"Could not distinguish between downloaded shapefiles for {iso}"
-            )
-            continue
-
-        boundary_lyr = read_file(boundary_shp[0])
-        if not boundary_lyr.crs:
-            boundary_lyr = boundary_lyr.set_crs(crs="EPSG:4326")
-        if not boundary_lyr.crs.name == "WGS 84":
-            boundary_lyr = boundary_lyr.to_crs(crs="EPSG:4326")
-
-        # calculate fields, finding admin1 name and pcode fields from config
-        boundary_lyr["alpha_3"] = iso.upper()
-        boundary_lyr["ADM0_REF"] = Country.get_country_name_from_iso3(iso)
-        boundary_lyr["ADM0_PCODE"] = Country.get_iso2_from_iso3(iso)
-
-        fields = boundary_lyr.columns
-        pcode_field = None
-        name_field = None
-        if "ADM1_PCODE" in fields:
-            pcode_field = "ADM1_PCODE"
-        if "ADM1_EN" in fields:
-            name_field = "ADM1_EN"
-        for field in fields:
-            if not pcode_field:
-                if (
-                    field.upper()
-                    in configuration["shapefile_attribute_mappings"]["pcode"]
-                ):
-                    pcode_field = field
-            if not name_field:
-                if (
-                    field.upper()
-                    in configuration["shapefile_attribute_mappings"]["name"]
-                ):
-                    name_field = field
-
-        if not name_field:
-            logger.error(f"Could not map name field for {iso}")
-            continue
-
-        if not pcode_field:
-            boundary_lyr["ADM1_PCODE"] = ""
-
-        # calculate text pcodes (if pcod is not in field name or there were no codes in the boundaries, create pcodes)
-        if pcode_field:
-            if is_numeric_dtype(boundary_lyr[pcode_field]):
-                if "PCOD" not in pcode_field:
-                    numrows = len(str(len(boundary_lyr.index)))
-                    for i, _ in boundary_lyr.iterrows():
-                        boundary_lyr.loc[i, "ADM1_PCODE"] = boundary_lyr.loc[
-                            i, "ADM0_PCODE"
-                        ] + str(int(boundary_lyr.loc[i, pcode_field])).zfill(numrows)
-                else:
-                    boundary_lyr["ADM1_PCODE"] = (
-                        boundary_lyr[pcode_field].astype(int).astype(str)
+        if incremental:
+            # record the inputs so that later runs can tell whether the country has changed
+            source = {
+                "resource_id": boundary_resource["id"],
+                "last_modified": boundary_resource.get("last_modified"),
+                "adm0_hash": geometry_hash(select_adm0(adm0_json, adm0_index, [iso])),
+            }
+            if iso in manifest:
+                previous = manifest[iso]
+                unchanged = all(previous.get(key) == value for key, value in source.items())
+                if unchanged:
+                    country_adm1 = adm1_json[adm1_json["alpha_3"] == iso]
+                    unchanged = previous.get("geometry_hash") == geometry_hash(
+                        country_adm1, "ADM1_PCODE"
                     )
-            else:
-                boundary_lyr["ADM1_PCODE"] = boundary_lyr[pcode_field]
-
-        boundary_lyr["ADM1_REF"] = boundary_lyr[name_field]
-        boundary_lyr = drop_fields(boundary_lyr, req_fields)
-        boundary_lyr = boundary_lyr.dissolve(by=req_fields, as_index=False)
-
-        if not pcode_field:
-            logger.error(f"Could not map pcodes - assigning randomly!")
-            numrows = len(str(len(boundary_lyr.index)))
-            for i, _ in boundary_lyr.iterrows():
-                boundary_lyr.loc[i, "ADM1_PCODE"] = boundary_lyr.loc[
-                    i, "ADM0_PCODE"
-                ] + str(i + 1).zfill(numrows)
-
-        na_count = boundary_lyr["ADM1_REF"].isna().sum()
-        if na_count > 0:
-            logger.warning(f"Found {na_count} null values in {iso} boundary")
-
-        # simplify geometry of boundaries
-        boundary_topo = Topology(boundary_lyr)
-        boundary_topo = boundary_topo.toposimplify(
-            epsilon=0.0075,
-            simplify_algorithm="dp",
-            prevent_oversimplify=True,
-        )
-        boundary_lyr = boundary_topo.to_gdf(crs="EPSG:4326")
-
-        # harmonize international boundary with UN admin0 country boundary
-        boundary_union = boundary_lyr.overlay(country_adm0, how="union")
-        boundary_slivers = boundary_union[["ISO_3", "geometry"]][boundary_union["alpha_3"].isna()]
-        boundary_union.dropna(axis=0, inplace=True)
-        boundary_slivers = boundary_slivers.explode(ignore_index=True)
-        boundary_slivers = boundary_slivers.sjoin(boundary_union, predicate="touches")
-        boundary_union = boundary_union.append(boundary_slivers)
-        boundary_union = boundary_union.dissolve(by=req_fields, as_index=False)
-        boundary_union = drop_fields(boundary_union, req_fields)
+                if unchanged:
+                    logger.info(f"Admin1 boundaries for {iso} have not changed - skipping")
+                    continue
+            manifest[iso] = source
+        process_countries.append(iso)
+        boundary_resources[iso] = boundary_resource
+
+    # build the water spatial index once so it is shared by every country processed here
+    water_json.sindex
+
+    # download the next countries' boundaries while the current one is being processed
+    boundary_files = prefetch(
+        process_countries,
+        lambda iso: prefetch_resource(boundary_resources[iso]),
+        configuration["prefetch"]["countries"],
+        configuration["prefetch"]["disk_budget_mb"],
+    )
+    # countries are processed independently, but merged back in a fixed order
+    boundary_lyrs = process_admin1_boundaries(
+        ((iso, boundary_resources[iso]) for iso, _ in boundary_files),
+        workers,
+        configuration["shapefile_attribute_mappings"],
+        adm0_json,
+        adm0_index,
+        water_json,
+        req_fields,
+    )
+    for iso in process_countries:
+        boundary_union = boundary_lyrs[iso]
+        if isinstance(boundary_union, type(None)):
+            if incremental:
+                manifest.pop(iso)
+                replace_json(manifest, manifest_file)
+            continue
 
         adm1_json = adm1_json[adm1_json["alpha_3"] != iso]
         adm1_json = adm1_json.append(boundary_union)
+        if incremental:
+            manifest[iso]["geometry_hash"] = geometry_hash(boundary_union, "ADM1_PCODE")
+            replace_json(manifest, manifest_file)
 
         logger.info(f"Finished processing admin1 boundaries for {iso}")
 
-    adm1_json.sort_values(by=["ADM1_PCODE"], inplace=True)
+    adm1_json = adm1_json.sort_values(by=["ADM1_PCODE"])
 
     # convert polygon boundaries to point
     adm1_centroid = GeoDataFrame(adm1_json.representative_point())
@@ -336,14 +208,16 @@ def update_boundaries(
             )[0]
             resource_c.set_file_to_upload(centroid_file)
 
-            try:
-                resource_a.update_in_hdx()
-            except HDXError:
-                logger.exception("Could not update polygon resource")
-            try:
-                resource_c.update_in_hdx()
-            except HDXError:
-                logger.exception("Could not update point resource")
+            with stage("upload", resource=resource_a["name"]):
+                try:
+                    resource_a.update_in_hdx()
+                except HDXError:
+                    logger.exception("Could not update polygon resource")
+            with stage("upload", resource=resource_c["name"]):
+                try:
+                    resource_c.update_in_hdx()
+                except HDXError:
+                    logger.exception("Could not update point resource")
 
         if data_source == "mapbox":
             logger.info(f"Updating Mapbox datasets")
@@ -380,12 +254,9 @@ def update_boundaries(
                 temp_folder=temp_folder,
             )
             # admin0 boundaries should include disputed areas and be dissolved to single features
-            # to_upload = adm0_json.copy(deep=True)
-            to_upload = adm0_json_lr.copy(deep=True)
-            to_upload = to_upload[
-                (to_upload["ISO_3"].isin(configuration["adm0"][visualization]))
-                | (to_upload["Color_Code"].isin(configuration["adm0"][visualization]))
-            ]
+            to_upload = select_adm0(
+                adm0_json_lr, adm0_lr_index, configuration["adm0"][visualization]
+            )
             to_upload.loc[to_upload["ISO_3"] == "XXX", "ISO_3"] = to_upload.loc[
                 to_upload["ISO_3"] == "XXX", "Color_Code"
             ]
@@ -428,31 +299,25 @@ def update_boundaries(
                 temp_folder=temp_folder,
             )
 
-    for visualization in visualizations:  # update admin1 lookups
+    # update admin1 lookups, normalizing names once for all visualizations
+    lookups = adm1_json[["ADM0_REF", "alpha_3", "ADM1_PCODE", "ADM1_REF"]].rename(
+        columns={
+            "ADM0_REF": "country",
+            "alpha_3": "iso3",
+            "ADM1_PCODE": "pcode",
+            "ADM1_REF": "name",
+        }
+    )
+    lookups["name"] = normalize_names(lookups["name"])
+    for visualization in visualizations:
         logger.info(f"Updating admin1 lookups for {visualization}")
-        attributes = list()
-        for _, row in adm1_json.iterrows():
-            if row["alpha_3"] in configuration["adm1"][visualization]:
-                new_name = row["ADM1_REF"].replace("-", " ").replace("`", "").replace("'", "")
-                new_name = (
-                    normalize("NFKD", new_name)
-                    .encode("ascii", "ignore")
-                    .decode("ascii")
-                )
-                attributes.append(
-                    {
-                        "country": row["ADM0_REF"],
-                        "iso3": row["alpha_3"],
-                        "pcode": row["ADM1_PCODE"],
-                        "name": new_name,
-                    }
-                )
-        attributes = sorted(attributes, key=lambda i: (i["country"], i["name"]))
+        attributes = lookups[lookups["iso3"].isin(configuration["adm1"][visualization])]
+        attributes = attributes.sort_values(by=["country", "name"])
 
         with open(
             join("saved_outputs", f"adm1-attributes-{visualization}.txt"), "w"
         ) as f:
-            for row in attributes:
+            for row in attributes.to_dict("records"):
                 if "," in row["name"]:
                     row["name"] = '"' + row["name"] + '"'
                 f.write("- %s\n" % str(row).replace("'", "").replace("|", "'"))
@@ -466,11 +331,9 @@ def update_boundaries(
         )
 
         # select only territories or disputed areas in visualization
-        adm0_region = adm0_json.copy(deep=True)
-        adm0_region = adm0_region[
-            (adm0_region["ISO_3"].isin(configuration["adm0"][visualization]))
-            | (adm0_region["Color_Code"].isin(configuration["adm0"][visualization]))
-        ]
+        adm0_region = select_adm0(
+            adm0_json, adm0_index, configuration["adm0"][visualization]
+        )
         adm0_region.loc[adm0_region["ISO_3"] == "XXX", "ISO_3"] = adm0_region.loc[
             adm0_region["ISO_3"] == "XXX", "Color_Code"
         ]
@@ -485,7 +348,11 @@ def update_boundaries(
         ] = "HRPs"
         regional_info = configuration["regional"]
         resource = find_resource(regional_info["dataset"], regional_info["format"])
-        _, iterator = downloader.get_tabular_rows(resource[0]["url"], dict_form=True)
+        try:
+            _, iterator = get_tabular_rows(downloader, resource[0])
+        except DownloadError:
+            logger.error(f"Could not download regional data - not updating regional bbox jsons")
+            return False
         for row in iterator:
             adm0_region.loc[
                 adm0_region["ISO_3"] == row[regional_info["iso3"]], "region"
@@ -526,4 +393,253 @@ def update_boundaries(
 
     logger.info("Updated regional bbox jsons")
 
-    return
+    return True
+
+
+def find_boundary_resource(iso, exceptions, resource_exceptions):
+    dataset_name = exceptions.get(iso)
+    resource_name = resource_exceptions.get(iso)
+    if not resource_name:
+        resource_name = "adm"
+    boundary_resource = None
+    if dataset_name:
+        boundary_resource = find_resource(dataset_name, "SHP", kw=resource_name)
+    if not boundary_resource:
+        boundary_resource = find_resource(
+            f"cod-em-{iso.lower()}", "SHP", kw=resource_name
+        )
+    if not boundary_resource:
+        boundary_resource = find_resource(
+            f"cod-ab-{iso.lower()}", "SHP", kw=resource_name
+        )
+    if not boundary_resource:
+        logger.error(f"Could not find boundary dataset for {iso}")
+        return None
+
+    if len(boundary_resource) > 1:
+        name_match = [
+            bool(re.match(".*adm(in)?(\s)?(0)?1.*", r["name"], re.IGNORECASE))
+            for r in boundary_resource
+        ]
+        boundary_resource = [
+            boundary_resource[i]
+            for i in range(len(boundary_resource))
+            if name_match[i]
+        ]
+
+        if len(boundary_resource) != 1:
+            logger.error(f"Could not distinguish between resources for {iso}")
+            return None
+
+    return boundary_resource[0]
+
+
+def process_admin1_boundaries(boundary_resources, workers, *args):
+    boundary_lyrs = dict()
+    if workers <= 1:
+        for iso, boundary_shp, adm0_fields in download_admin1_boundaries(boundary_resources):
+            boundary_lyrs[iso] = process_country_boundaries(iso, boundary_shp, adm0_fields, *args)
+            remove_unzipped_download(boundary_shp or [])
+        return boundary_lyrs
+
+    # workers are spawned rather than forked, so they get the settings of this process as
+    # arguments instead of inheriting them, and do not inherit locks held by other threads;
+    # spatial indexes are empty once pickled, so layers are sent without them
+    args = tuple(without_sindex(arg) if isinstance(arg, GeoDataFrame) else arg for arg in args)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_set_worker_args,
+        initargs=(get_cache_settings(), report_enabled(), *args),
+    ) as executor:
+        futures = {
+            iso: (executor.submit(_process_in_worker, iso, boundary_shp, adm0_fields), boundary_shp)
+            for iso, boundary_shp, adm0_fields in download_admin1_boundaries(boundary_resources)
+        }
+        for iso, (future, boundary_shp) in futures.items():
+            try:
+                boundary_lyrs[iso], stages = future.result()
+                add_report_stages(stages)
+            except Exception:
+                logger.exception(f"Could not process admin1 boundaries for {iso}")
+                boundary_lyrs[iso] = None
+            remove_unzipped_download(boundary_shp or [])
+    return boundary_lyrs
+
+
+def download_admin1_boundaries(boundary_resources):
+    # resources and country names are looked up and downloaded in this process, so workers
+    # only read the files
+    for iso, boundary_resource in boundary_resources:
+        set_report_context(country=iso)
+        boundary_shp = download_unzip_read_data(boundary_resource, "shp", unzip=True)
+        adm0_fields = {
+            "alpha_3": iso.upper(),
+            "ADM0_REF": Country.get_country_name_from_iso3(iso),
+            "ADM0_PCODE": Country.get_iso2_from_iso3(iso),
+        }
+        yield iso, boundary_shp, adm0_fields
+    set_report_context(country=None)
+
+
+_worker_args = tuple()
+
+
+def _set_worker_args(cache_settings, report, *args):
+    global _worker_args
+    set_cache_settings(cache_settings)
+    if report:
+        enable_report()
+    _worker_args = args
+
+
+def _process_in_worker(iso, boundary_shp, adm0_fields):
+    # stages recorded in the worker are sent back with the result
+    set_report_context(scraper="boundaries")
+    boundary_union = process_country_boundaries(iso, boundary_shp, adm0_fields, *_worker_args)
+    return boundary_union, pop_report_stages()
+
+
+def process_country_boundaries(iso, boundary_shp, adm0_fields, *args):
+    try:
+        return _process_country_boundaries(iso, boundary_shp, adm0_fields, *args)
+    except Exception:
+        logger.exception(f"Could not process admin1 boundaries for {iso}")
+        return None
+
+
+def _process_country_boundaries(
+    iso,
+    boundary_shp,
+    adm0_fields,
+    attribute_mappings,
+    adm0_json,
+    adm0_index,
+    water_json,
+    req_fields,
+):
+    if not boundary_shp:
+        return None
+
+    logger.info(f"Processing admin1 boundaries for {iso}")
+    set_report_context(country=iso)
+
+    # select single country boundary (including disputed areas), cut out water, and dissolve
+    with stage("overlay", step="water") as record:
+        country_adm0 = select_adm0(adm0_json, adm0_index, [iso])
+        country_water = clip_to_extent(water_json, country_adm0)
+        record["rows_in"] = len(country_water.index)
+        country_adm0 = country_adm0.overlay(country_water, how="difference")
+        country_adm0 = country_adm0.dissolve()
+    country_adm0 = drop_fields(country_adm0, ["ISO_3"])
+    country_adm0["ISO_3"] = iso
+    if not country_adm0.crs:
+        country_adm0 = country_adm0.set_crs(crs="EPSG:4326")
+
+    # find the correct admin boundary shapefile in the downloaded zip
+    if len(boundary_shp) > 1:
+        name_match = [
+            bool(re.match(".*admbnda.*adm(in)?(0)?1.*", zip_member_name(b), re.IGNORECASE))
+            for b in boundary_shp
+        ]
+        if any(name_match):
+            boundary_shp = [
+                boundary_shp[i] for i in range(len(boundary_shp)) if name_match[i]
+            ]
+
+    if len(boundary_shp) > 1:
+        simp_match = [
+            bool(re.match(".*simplified.*", zip_member_name(b), re.IGNORECASE))
+            for b in boundary_shp
+        ]
+        if any(simp_match):
+            boundary_shp = [
+                boundary_shp[i]
+                for i in range(len(boundary_shp))
+                if not simp_match[i]
+            ]
+
+    if len(boundary_shp) != 1:
+        logger.error(
+            f"Could not distinguish between downloaded shapefiles for {iso}"
+        )
+        return None
+
+    with stage("read", resource=zip_member_name(boundary_shp[0])) as record:
+        boundary_lyr = read_file(boundary_shp[0])
+        record["rows_out"] = len(boundary_lyr.index)
+    if not boundary_lyr.crs:
+        boundary_lyr = boundary_lyr.set_crs(crs="EPSG:4326")
+    if not boundary_lyr.crs.name == "WGS 84":
+        boundary_lyr = boundary_lyr.to_crs(crs="EPSG:4326")
+
+    # calculate fields, finding admin1 name and pcode fields from config
+    for field, value in adm0_fields.items():
+        boundary_lyr[field] = value
+
+    pcode_field, name_field = find_attribute_fields(boundary_lyr.columns, attribute_mappings)
+
+    if not name_field:
+        logger.error(f"Could not map name field for {iso}")
+        return None
+
+    if not pcode_field:
+        boundary_lyr["ADM1_PCODE"] = ""
+
+    # calculate text pcodes (if pcod is not in field name or there were no codes in the boundaries, create pcodes)
+    if pcode_field:
+        if is_numeric_dtype(boundary_lyr[pcode_field]):
+            if "PCOD" not in pcode_field:
+                boundary_lyr["ADM1_PCODE"] = build_pcodes(
+                    boundary_lyr["ADM0_PCODE"], boundary_lyr[pcode_field]
+                )
+            else:
+                boundary_lyr["ADM1_PCODE"] = (
+                    boundary_lyr[pcode_field].astype(int).astype(str)
+                )
+        else:
+            boundary_lyr["ADM1_PCODE"] = boundary_lyr[pcode_field]
+
+    boundary_lyr["ADM1_REF"] = boundary_lyr[name_field]
+    boundary_lyr = drop_fields(boundary_lyr, req_fields)
+    boundary_lyr = boundary_lyr.dissolve(by=req_fields, as_index=False)
+
+    if not pcode_field:
+        logger.error(f"Could not map pcodes - assigning randomly!")
+        boundary_lyr["ADM1_PCODE"] = build_sequential_pcodes(boundary_lyr["ADM0_PCODE"])
+
+    na_count = boundary_lyr["ADM1_REF"].isna().sum()
+    if na_count > 0:
+        logger.warning(f"Found {na_count} null values in {iso} boundary")
+
+    # simplified and harmonized boundaries are cached by their inputs
+    cache_key = layer_hash(
+        boundary_lyr,
+        country_adm0,
+        params=dict(simplify_params, slivers="longest_shared_boundary"),
+    )
+    boundary_union = read_cached_layer(f"boundaries-{iso}", cache_key)
+    if not isinstance(boundary_union, type(None)):
+        logger.info(f"Using cached simplified boundaries for {iso}")
+        return boundary_union
+
+    # simplify geometry of boundaries
+    with stage("simplify", rows_in=len(boundary_lyr.index)):
+        boundary_topo = Topology(boundary_lyr)
+        boundary_topo = boundary_topo.toposimplify(**simplify_params)
+        boundary_lyr = boundary_topo.to_gdf(crs="EPSG:4326")
+
+    # harmonize international boundary with UN admin0 country boundary
+    with stage("harmonize", rows_in=len(boundary_lyr.index)) as record:
+        boundary_union = boundary_lyr.overlay(country_adm0, how="union")
+        boundary_slivers = boundary_union[["ISO_3", "geometry"]][boundary_union["alpha_3"].isna()]
+        boundary_union.dropna(axis=0, inplace=True)
+        boundary_slivers = boundary_slivers.explode(ignore_index=True)
+        boundary_slivers = assign_slivers(boundary_slivers, boundary_union, req_fields)
+        boundary_union = boundary_union.append(boundary_slivers)
+        boundary_union = boundary_union.dissolve(by=req_fields, as_index=False)
+        boundary_union = drop_fields(boundary_union, req_fields)
+        record["rows_out"] = len(boundary_union.index)
+    write_cached_layer(f"boundaries-{iso}", cache_key, boundary_union)
+
+    return boundary_union
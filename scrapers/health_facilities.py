@@ -1,13 +1,17 @@
 import logging
 from os.path import join
-from pandas import DataFrame
+from pandas import DataFrame, concat
 
 from hdx.data.hdxobject import HDXError
+from scrapers.utilities.geo_functions import select_attributes
 from scrapers.utilities.hdx_functions import (
     download_unzip_read_data,
     find_resource,
+    prefetch,
+    prefetch_resource,
     update_csv_resource,
 )
+from scrapers.utilities.report_functions import set_report_context, stage
 
 logger = logging.getLogger()
 
@@ -20,6 +24,7 @@ def update_health_facilities(
     temp_folder,
     countries=None,
 ):
+    prefetch_configuration = configuration["prefetch"]
     configuration = configuration["health_facilities"]
 
     if not countries:
@@ -32,38 +37,65 @@ def update_health_facilities(
     if not exceptions:
         exceptions = {}
 
-    adm1_json["Health_Facilities"] = None
-    adm1_json.drop(adm1_json.index[~adm1_json["alpha_3"].isin(countries)], inplace=True)
-
-    for iso in countries:
+    # admin1 boundaries are shared by all scrapers, so only their attributes are copied
+    selected = adm1_json["alpha_3"].isin(countries)
+    adm1_health = select_attributes(adm1_json, selected)
+    adm1_health["Health_Facilities"] = None
+
+    # points are joined to the units of every selected country, as a country's points near a border
+    # can fall in a neighbour's unit, and counted a chunk at a time so only counts are kept; the
+    # spatial index of the units is built once for every join
+    adm1_lyr = adm1_json.loc[selected, ["ADM1_PCODE", "geometry"]]
+    adm1_lyr.sindex
+    adm1_bounds = adm1_lyr.total_bounds
+    counts = list()
+    # look up and download the next countries' points while the current one is being read
+    health_resources = prefetch(
+        countries,
+        lambda iso: prefetch_health_resource(iso, exceptions),
+        prefetch_configuration["countries"],
+        prefetch_configuration["disk_budget_mb"],
+    )
+    for order, (iso, health_resource) in enumerate(health_resources):
         logger.info(f"Processing health facilities for {iso}")
+        set_report_context(country=iso)
 
-        dataset_name = exceptions.get(iso)
-        if not dataset_name:
-            dataset_name = f"hotosm_{iso.lower()}_health_facilities"
-
-        health_resource = find_resource(dataset_name, "shp", kw="point")
         if not health_resource:
             continue
 
-        health_shp_lyr = download_unzip_read_data(
-            health_resource[0], "shp", unzip=True, read=True
+        # only geometries are needed, and only where they can fall inside admin1 units
+        health_chunks = download_unzip_read_data(
+            health_resource[0],
+            "shp",
+            unzip=True,
+            read=True,
+            columns=[],
+            bbox=adm1_bounds,
+            chunk_size=configuration.get("chunk_size"),
         )
-        if isinstance(health_shp_lyr, type(None)):
+        if isinstance(health_chunks, type(None)):
             continue
+        if not configuration.get("chunk_size"):
+            health_chunks = [health_chunks]
+
+        for health_shp_lyr in health_chunks:
+            counts.append(count_health_facilities(health_shp_lyr, adm1_lyr, order))
+
+    set_report_context(country=None)
+    if len(counts) > 0:
+        join_lyr = concat(counts).groupby(["ADM1_PCODE", "order"])["Health_Facilities"].sum()
+        join_lyr = join_lyr.reset_index()
+        # a later country's count for a unit replaces an earlier one, as when joined one by one
+        join_lyr = join_lyr.sort_values(by="order").drop_duplicates(
+            subset="ADM1_PCODE", keep="last"
+        )
+        join_lyr = join_lyr.set_index("ADM1_PCODE")["Health_Facilities"]
+        adm1_health["Health_Facilities"] = adm1_health["ADM1_PCODE"].map(join_lyr.astype(object))
 
-        join_lyr = health_shp_lyr.sjoin(adm1_json)
-        join_lyr = DataFrame(join_lyr)
-        join_lyr = join_lyr.groupby("ADM1_PCODE").size()
-        for pcode in join_lyr.index:
-            hfs = join_lyr[pcode]
-            adm1_json.loc[adm1_json["ADM1_PCODE"] == pcode, "Health_Facilities"] = hfs
-
-    adm1_json = adm1_json.drop(columns="geometry")
-    adm1_json.sort_values(by=["ADM1_PCODE"], inplace=True)
-    updated_countries = list(set(adm1_json["alpha_3"][~adm1_json["Health_Facilities"].isna()]))
-    adm1_json.loc[
-        adm1_json["Health_Facilities"].isna() & adm1_json["alpha_3"].isin(updated_countries),
+    adm1_health = adm1_health.sort_values(by=["ADM1_PCODE"])
+    updated_countries = list(set(adm1_health["alpha_3"][~adm1_health["Health_Facilities"].isna()]))
+    adm1_health.loc[
+        adm1_health["Health_Facilities"].isna() & adm1_health["alpha_3"].isin(updated_countries),
         "Health_Facilities",
     ] = 0
     resource = find_resource(configuration["dataset"], "csv")
@@ -71,19 +103,47 @@ def update_health_facilities(
         resource = resource[0]
     except IndexError:
         logger.error(f"Could not find resource")
-        return
+        return False
     updated_resource = update_csv_resource(
         resource,
         downloader,
-        adm1_json,
+        adm1_health,
         updated_countries,
+        join(temp_folder, "health_facilities_by_adm1.csv"),
     )
-    updated_resource.to_csv(join(temp_folder, "health_facilities_by_adm1.csv"), index=False)
-
-    resource.set_file_to_upload(join(temp_folder, "health_facilities_by_adm1.csv"))
-    try:
-        resource.update_in_hdx()
-    except HDXError:
-        logger.exception("Could not update health facilities resource")
-
-    return
+    if not updated_resource:
+        return False
+
+    resource.set_file_to_upload(updated_resource)
+    with stage("upload", resource=resource["name"]):
+        try:
+            resource.update_in_hdx()
+        except HDXError:
+            logger.exception("Could not update health facilities resource")
+            return False
+
+    return True
+
+
+def count_health_facilities(health_shp_lyr, adm1_lyr, order):
+    with stage("sjoin", rows_in=len(health_shp_lyr.index)) as record:
+        join_lyr = health_shp_lyr.sjoin(adm1_lyr)
+        record["rows_out"] = len(join_lyr.index)
+    counts = DataFrame(join_lyr).groupby("ADM1_PCODE").size()
+    counts = counts.reset_index(name="Health_Facilities")
+    counts["order"] = order
+    return counts
+
+
+def find_health_resource(iso, exceptions):
+    dataset_name = exceptions.get(iso)
+    if not dataset_name:
+        dataset_name = f"hotosm_{iso.lower()}_health_facilities"
+    return find_resource(dataset_name, "shp", kw="point")
+
+
+def prefetch_health_resource(iso, exceptions):
+    health_resource = find_health_resource(iso, exceptions)
+    if health_resource:
+        prefetch_resource(health_resource[0])
+    return health_resource
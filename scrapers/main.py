@@ -1,14 +1,37 @@
 import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from sys import stderr
+
+from loguru import logger as loguru_logger
+
+from hdx.utilities.downloader import Download
 
 from scrapers.un_boundaries import update_un_boundaries
 from scrapers.boundaries import update_boundaries
 from scrapers.health_facilities import update_health_facilities
 from scrapers.population import update_population
 from scrapers.utilities.mapbox_functions import download_from_mapbox
-from scrapers.utilities.hdx_functions import find_resource, download_unzip_read_data
+from scrapers.utilities.hdx_functions import (
+    download_unzip_read_data,
+    find_resource,
+    get_rate_limit,
+    log_dataset_lookups,
+    reset_dataset_lookups,
+)
+from scrapers.utilities.report_functions import get_report_context, set_report_context
 
 logger = logging.getLogger(__name__)
 
+scraper_log_format = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "<magenta>{extra[scraper]}</magenta> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+# UN boundaries and lakes that are needed to update admin1 boundaries
+boundaries_layers = ["polbnda_int_1m", "polbnda_int_15m", "polbndl_int", "polbndp_int", "lake"]
+
 
 def get_indicators(
         configuration,
@@ -20,16 +43,15 @@ def get_indicators(
         scrapers_to_run=None,
         countries=None,
         visualizations=None,
+        workers=1,
+        incremental=False,
+        scraper_workers=1,
 ):
 
     if not scrapers_to_run:
         scrapers_to_run = ["boundaries", "health_facilities", "population"]
 
-    if "un_boundaries" in scrapers_to_run:
-        update_un_boundaries(
-            configuration,
-            mapbox_auth,
-        )
+    reset_dataset_lookups()
 
     adm1_countries = set()
     for viz in configuration["adm1"]:
@@ -38,45 +60,220 @@ def get_indicators(
     adm1_countries = list(adm1_countries)
     adm1_countries.sort()
 
-    if data_source == "hdx":
-        resource = find_resource(configuration["boundaries"]["dataset"], "geojson", kw="polbnda_adm1")
-        if not resource:
-            return
-        adm1_json = download_unzip_read_data(resource[0], file_type="geojson", unzip=False, read=True)
-    if data_source == "mapbox":
-        adm1_json = download_from_mapbox(configuration["mapbox"]["global"]["polbnda_adm1"], mapbox_auth)
-        if isinstance(adm1_json, type(None)):
-            return
+    # global layers are shared by the scrapers, and must not be changed in place
+    data = dict()
 
-    if "boundaries" in scrapers_to_run:
-        update_boundaries(
+    def run_un_boundaries():
+        return update_un_boundaries(
             configuration,
-            downloader,
             mapbox_auth,
-            temp_folder,
-            adm1_json,
-            data_source,
-            update_tilesets,
-            visualizations,
-            countries,
         )
-    if "population" in scrapers_to_run:
-        update_population(
-            configuration,
-            downloader,
-            adm1_countries,
-            adm1_json,
-            temp_folder,
-            countries,
+
+    def run_adm1_layer():
+        data["adm1_layer"] = load_global_layers(
+            configuration, data_source, mapbox_auth, ["polbnda_adm1"]
         )
-    if "health_facilities" in scrapers_to_run:
-        update_health_facilities(
-            configuration,
-            downloader,
-            adm1_countries,
-            adm1_json,
-            temp_folder,
-            countries,
+        return data["adm1_layer"] is not None
+
+    def run_boundaries_layers():
+        data["boundaries_layers"] = load_global_layers(
+            configuration, data_source, mapbox_auth, boundaries_layers
         )
+        return data["boundaries_layers"] is not None
+
+    def run_boundaries():
+        with scraper_downloader(downloader, scraper_workers) as scraper_download:
+            return update_boundaries(
+                configuration,
+                scraper_download,
+                mapbox_auth,
+                temp_folder,
+                dict(data["boundaries_layers"], **data["adm1_layer"]),
+                data_source,
+                update_tilesets,
+                visualizations,
+                countries,
+                workers,
+                incremental,
+            )
 
+    def run_population():
+        with scraper_downloader(downloader, scraper_workers) as scraper_download:
+            return update_population(
+                configuration,
+                scraper_download,
+                adm1_countries,
+                data["adm1_layer"]["polbnda_adm1"],
+                temp_folder,
+                countries,
+                workers,
+            )
+
+    def run_health_facilities():
+        with scraper_downloader(downloader, scraper_workers) as scraper_download:
+            return update_health_facilities(
+                configuration,
+                scraper_download,
+                adm1_countries,
+                data["adm1_layer"]["polbnda_adm1"],
+                temp_folder,
+                countries,
+            )
+
+    # scrapers run as soon as the tasks producing their inputs have finished
+    tasks = {
+        "un_boundaries": {
+            "run": run_un_boundaries,
+            "inputs": [],
+            "outputs": ["un_layers"],
+        },
+        "adm1_layer": {
+            "run": run_adm1_layer,
+            "inputs": [],
+            "outputs": ["adm1_layer"],
+        },
+        "boundaries_layers": {
+            "run": run_boundaries_layers,
+            "inputs": ["un_layers"],
+            "outputs": ["boundaries_layers"],
+        },
+        "boundaries": {
+            "run": run_boundaries,
+            "inputs": ["adm1_layer", "boundaries_layers"],
+            "outputs": ["adm1_layers"],
+        },
+        "population": {
+            "run": run_population,
+            "inputs": ["adm1_layer"],
+            "outputs": ["population"],
+        },
+        "health_facilities": {
+            "run": run_health_facilities,
+            "inputs": ["adm1_layer"],
+            "outputs": ["health_facilities"],
+        },
+    }
+    # the layers are only loaded for the scrapers that need them
+    needed = set(scrapers_to_run)
+    if "boundaries" in needed:
+        needed.add("boundaries_layers")
+    if needed & {"boundaries", "population", "health_facilities"}:
+        needed.add("adm1_layer")
+    tasks = {name: task for name, task in tasks.items() if name in needed}
+    if scraper_workers > 1:
+        log_scraper_names()
+    run_tasks(tasks, scraper_workers)
+
+    log_dataset_lookups()
     return
+
+
+def run_tasks(tasks, workers=1):
+    # run each task once the tasks producing its inputs have succeeded, skipping it if one failed;
+    # inputs that no task produces are already available
+    producers = {output: name for name, task in tasks.items() for output in task["outputs"]}
+    waiting = {
+        name: {producers[i] for i in task["inputs"] if i in producers}
+        for name, task in tasks.items()
+    }
+    succeeded = set()
+    failed = set()
+    running = dict()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(waiting) > 0 or len(running) > 0:
+            for name in [n for n, needs in waiting.items() if needs & failed]:
+                failed_inputs = ", ".join(sorted(waiting.pop(name) & failed))
+                logger.error(f"Not running {name} as {failed_inputs} failed")
+                failed.add(name)
+            for name in [n for n, needs in waiting.items() if needs <= succeeded]:
+                waiting.pop(name)
+                running[executor.submit(_run_task, name, tasks[name]["run"])] = name
+            if len(running) == 0:
+                if len(waiting) == 0:
+                    break
+                if any(needs & failed for needs in waiting.values()):
+                    continue
+                logger.error(f"Could not run {', '.join(waiting)} as their inputs are not produced")
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.result():
+                    succeeded.add(name)
+                else:
+                    failed.add(name)
+    return succeeded
+
+
+def _run_task(name, run):
+    # a task only succeeds if it returns True, and fails without stopping the others
+    set_report_context(scraper=name, country=None)
+    try:
+        return run() is True
+    except Exception:
+        logger.exception(f"{name} failed")
+        return False
+
+
+@contextmanager
+def scraper_downloader(downloader, scraper_workers):
+    # requests sessions are not thread safe, so scrapers running at the same time each get their own
+    if scraper_workers <= 1:
+        yield downloader
+        return
+    with Download(rate_limit=get_rate_limit()) as scraper_download:
+        yield scraper_download
+
+
+def log_scraper_names():
+    # scrapers that run at the same time interleave their logs, so each message names its scraper;
+    # standard logging is sent on to loguru, which adds the scraper as a field of the log line.
+    # Only the console handler is replaced so that log files keep theirs; loguru has no public way
+    # to find a handler's sink
+    loguru_logger.configure(patcher=_add_scraper_field)
+    for handler_id, handler in list(loguru_logger._core.handlers.items()):
+        if handler._name == "<stderr>":
+            loguru_logger.remove(handler_id)
+    loguru_logger.add(
+        stderr,
+        level="INFO",
+        format=scraper_log_format,
+        colorize=True,
+        backtrace=True,
+        diagnose=True,
+    )
+
+
+def _add_scraper_field(record):
+    record["extra"]["scraper"] = get_report_context("scraper") or "-"
+
+
+def load_global_layers(configuration, data_source, mapbox_auth, layer_names):
+    # look up the boundaries dataset once so that every thread uses the same metadata
+    if data_source == "hdx":
+        find_resource(configuration["boundaries"]["dataset"])
+
+    with ThreadPoolExecutor(max_workers=len(layer_names)) as executor:
+        futures = {
+            name: executor.submit(load_global_layer, configuration, data_source, mapbox_auth, name)
+            for name in layer_names
+        }
+        global_layers = {name: future.result() for name, future in futures.items()}
+
+    missing = [name for name in layer_names if isinstance(global_layers[name], type(None))]
+    if len(missing) > 0:
+        logger.error(f"Could not load global layers: {', '.join(missing)}")
+        return None
+    return global_layers
+
+
+def load_global_layer(configuration, data_source, mapbox_auth, name):
+    set_report_context(scraper="global_layers", country=None)
+    if data_source == "hdx":
+        resource = find_resource(configuration["boundaries"]["dataset"], "geojson", kw=name)
+        if not resource:
+            return None
+        return download_unzip_read_data(resource[0], file_type="geojson", unzip=False, read=True)
+    if data_source == "mapbox":
+        return download_from_mapbox(configuration["mapbox"]["global"][name], mapbox_auth)
+    return None
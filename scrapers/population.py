@@ -1,18 +1,35 @@
 import logging
 import re
 from os.path import join
-from rasterstats import zonal_stats
+from pandas import DataFrame, Series
 from slugify import slugify
 
 from hdx.location.country import Country
 from hdx.data.hdxobject import HDXError
-from scrapers.utilities.hdx_functions import download_unzip_read_data, find_resource, update_csv_resource
+from hdx.utilities.downloader import DownloadError
+from scrapers.utilities.geo_functions import select_attributes
+from scrapers.utilities.hdx_functions import (
+    download_unzip_read_data,
+    find_resource,
+    get_tabular_rows,
+    prefetch,
+    prefetch_resource,
+    update_csv_resource,
+)
+from scrapers.utilities.raster_functions import raster_pool, zonal_sums
+from scrapers.utilities.report_functions import set_report_context, stage
 
 logger = logging.getLogger()
 
 
 def update_population(
-    configuration, downloader, adm1_countries, adm1_json, temp_folder, countries=None
+    configuration,
+    downloader,
+    adm1_countries,
+    adm1_json,
+    temp_folder,
+    countries=None,
+    workers=1,
 ):
 
     if not countries:
@@ -29,134 +46,175 @@ def update_population(
     if not resource_exceptions:
         resource_exceptions = {}
 
-    adm1_json["Population"] = None
-    adm1_json.drop(adm1_json.index[~adm1_json["alpha_3"].isin(countries)], inplace=True)
+    # admin1 boundaries are shared by all scrapers, so only their attributes are copied
+    adm1_pop = select_attributes(adm1_json, adm1_json["alpha_3"].isin(countries))
+    adm1_pop["Population"] = None
 
-    for iso in countries:
-        logger.info(f"Processing population for {iso}")
-
-        dataset_name = exceptions.get(iso)
-        resource_name = resource_exceptions.get(iso)
-        if not resource_name:
-            resource_name = "adm(in)?1"
-        if not dataset_name:
-            dataset_name = f"cod-ps-{iso.lower()}"
+    # look up and download the next countries' data while the current one is being processed
+    pop_resources = prefetch(
+        countries,
+        lambda iso: prefetch_population_resource(iso, exceptions, resource_exceptions),
+        configuration["prefetch"]["countries"],
+        configuration["prefetch"]["disk_budget_mb"],
+    )
+    # the workers summing rasters are started once for all countries
+    with raster_pool(workers) as pool:
+        for iso, pop_resource in pop_resources:
+            logger.info(f"Processing population for {iso}")
+            set_report_context(country=iso)
 
-        pop_resource = find_resource(dataset_name, "csv", kw=resource_name)
-        if not pop_resource:
-            dataset_name = f"worldpop-population-counts-for-{slugify(Country.get_country_name_from_iso3(iso))}"
-            pop_resource = find_resource(dataset_name, "geotiff", kw="(?<!\d)\d{4}_constrained")
             if not pop_resource:
                 logger.warning(f"Could not find any population data for {iso}")
                 continue
+            pop_resource, file_type = pop_resource
+
+            if file_type == "geotiff":
+                pop_raster = download_unzip_read_data(pop_resource[0], file_type="tif")
+                if not pop_raster:
+                    continue
+
+                country_adm1 = adm1_json.loc[adm1_json["alpha_3"] == iso]
+                with stage("zonal_stats", rows_in=len(country_adm1.index)):
+                    pop_sums = zonal_sums(
+                        country_adm1.geometry, pop_raster[0], workers, pool=pool
+                    )
+                pop_sums = Series(pop_sums, index=country_adm1.index, dtype="float64")
+                pop_sums = pop_sums[pop_sums.notna() & (pop_sums != 0)]
+                adm1_pop.loc[pop_sums.index, "Population"] = pop_sums.round().astype(int)
+                continue
 
-            pop_raster = download_unzip_read_data(pop_resource[0], file_type="tif")
-            if not pop_raster:
+            if len(pop_resource) > 1:
+                yearmatches = [re.findall("(?<!\d)\d{4}(?!\d)", r["name"], re.IGNORECASE) for r in pop_resource]
+                yearmatches = sum(yearmatches, [])
+                if len(yearmatches) > 0:
+                    yearmatches = [int(y) for y in yearmatches]
+                maxyear = [r for r in pop_resource if str(max(yearmatches)) in r["name"]]
+                if len(maxyear) == 1:
+                    pop_resource = maxyear
+
+            if len(pop_resource) > 1:
+                logger.warning(f"Found multiple resources for {iso}, using first in list")
+
+            try:
+                headers, iterator = get_tabular_rows(downloader, pop_resource[0])
+            except DownloadError:
+                logger.error(f"Could not download population data for {iso}")
                 continue
 
-            pop_stats = zonal_stats(
-                vectors=adm1_json.loc[(adm1_json["alpha_3"] == iso)],
-                raster=pop_raster[0],
-                stats="sum",
-                geojson_out=True,
-            )
-            for row in pop_stats:
-                pcode = row["properties"]["ADM1_PCODE"]
-                pop = row["properties"]["sum"]
-                if pop:
-                    pop = int(round(pop, 0))
-                    adm1_json.loc[adm1_json["ADM1_PCODE"] == pcode, "Population"] = pop
-
-        if len(pop_resource) > 1:
-            yearmatches = [re.findall("(?<!\d)\d{4}(?!\d)", r["name"], re.IGNORECASE) for r in pop_resource]
-            yearmatches = sum(yearmatches, [])
-            if len(yearmatches) > 0:
+            pcode_header = None
+            pop_header = []
+            for header in headers:
+                if not pcode_header:
+                    if (
+                        header.upper()
+                        in configuration["population_attribute_mappings"]["pcode"]
+                    ):
+                        pcode_header = header
+                if header.upper() in configuration["population_attribute_mappings"]["pop"]:
+                    pop_header.append(header)
+                else:
+                    yearmatch = re.findall("(?<!\d)\d{4}(?!\d)", header, re.IGNORECASE)
+                    if len(yearmatch) > 0:
+                        check_header = re.sub("(?<!\d)\d{4}(?!\d)", "Y", header, re.IGNORECASE)
+                        if check_header.upper() in configuration["population_attribute_mappings"]["pop_with_years"]:
+                            pop_header.append(header)
+
+            if len(pop_header) > 1:
+                yearmatches = [re.findall("(?<!\d)\d{4}(?!\d)", header, re.IGNORECASE) for header in pop_header]
+                yearmatches = sum(yearmatches, [])
+                if len(yearmatches) == 0:
+                    logger.info(f"Not sure which header to pick: {pop_header}")
+                    continue
                 yearmatches = [int(y) for y in yearmatches]
-            maxyear = [r for r in pop_resource if str(max(yearmatches)) in r["name"]]
-            if len(maxyear) == 1:
-                pop_resource = maxyear
-
-        if len(pop_resource) > 1:
-            logger.warning(f"Found multiple resources for {iso}, using first in list")
-
-        headers, iterator = downloader.get_tabular_rows(
-            pop_resource[0]["url"], dict_form=True
-        )
+                maxyear = [h for h in pop_header if str(max(yearmatches)) in h]
+                if len(maxyear) != 1:
+                    logger.info(f"Not sure which header to pick: {pop_header}")
+                    continue
+                pop_header = maxyear
 
-        pcode_header = None
-        pop_header = []
-        for header in headers:
             if not pcode_header:
-                if (
-                    header.upper()
-                    in configuration["population_attribute_mappings"]["pcode"]
-                ):
-                    pcode_header = header
-            if header.upper() in configuration["population_attribute_mappings"]["pop"]:
-                pop_header.append(header)
-            else:
-                yearmatch = re.findall("(?<!\d)\d{4}(?!\d)", header, re.IGNORECASE)
-                if len(yearmatch) > 0:
-                    check_header = re.sub("(?<!\d)\d{4}(?!\d)", "Y", header, re.IGNORECASE)
-                    if check_header.upper() in configuration["population_attribute_mappings"]["pop_with_years"]:
-                        pop_header.append(header)
-
-        if len(pop_header) > 1:
-            yearmatches = [re.findall("(?<!\d)\d{4}(?!\d)", header, re.IGNORECASE) for header in pop_header]
-            yearmatches = sum(yearmatches, [])
-            if len(yearmatches) == 0:
-                logger.info(f"Not sure which header to pick: {pop_header}")
+                logger.error(f"Could not find pcode header for {iso}")
                 continue
-            yearmatches = [int(y) for y in yearmatches]
-            maxyear = [h for h in pop_header if str(max(yearmatches)) in h]
-            if len(maxyear) != 1:
-                logger.info(f"Not sure which header to pick: {pop_header}")
+            if len(pop_header) != 1:
+                logger.error(f"Could not find pop header for {iso}")
                 continue
-            pop_header = maxyear
-
-        if not pcode_header:
-            logger.error(f"Could not find pcode header for {iso}")
-            continue
-        if len(pop_header) != 1:
-            logger.error(f"Could not find pop header for {iso}")
-            continue
-        pop_header = pop_header[0]
-
-        for row in iterator:
-            pcode = row[pcode_header]
-            pop = row[pop_header]
-            if pcode not in list(adm1_json["ADM1_PCODE"]):
+            pop_header = pop_header[0]
+
+            with stage("read", resource=pop_resource[0]["name"]) as record:
+                pop_rows = DataFrame(
+                    [(row[pcode_header], row[pop_header]) for row in iterator],
+                    columns=["ADM1_PCODE", "Population"],
+                )
+                record["rows_out"] = len(pop_rows.index)
+            pop_rows.drop_duplicates(subset="ADM1_PCODE", keep="last", inplace=True)
+            pop_rows.set_index("ADM1_PCODE", inplace=True)
+
+            for pcode in sorted(set(pop_rows.index) - set(adm1_pop["ADM1_PCODE"]), key=str):
                 logger.info(f"Could not find unit {pcode} in boundaries for {iso}")
-            else:
-                adm1_json.loc[adm1_json["ADM1_PCODE"] == pcode, "Population"] = pop
 
-    for index, row in adm1_json.iterrows():
+            matched = adm1_pop["ADM1_PCODE"].isin(pop_rows.index)
+            adm1_pop.loc[matched, "Population"] = adm1_pop.loc[matched, "ADM1_PCODE"].map(
+                pop_rows["Population"]
+            )
+
+    set_report_context(country=None)
+    for index, row in adm1_pop.iterrows():
         if not row["Population"]:
             logger.info(
                 f"Could not find unit {row['ADM1_PCODE']} in statistics for {row['alpha_3']}"
             )
 
-    adm1_json.drop(columns="geometry", inplace=True)
-    adm1_json.sort_values(by=["ADM1_PCODE"], inplace=True)
-    updated_countries = list(set(adm1_json["alpha_3"][~adm1_json["Population"].isna()]))
+    adm1_pop = adm1_pop.sort_values(by=["ADM1_PCODE"])
+    updated_countries = list(set(adm1_pop["alpha_3"][~adm1_pop["Population"].isna()]))
     resource = find_resource(configuration["population"]["dataset"], "csv")
     try:
         resource = resource[0]
     except IndexError:
         logger.error(f"Could not find population resource")
-        return
+        return False
     updated_resource = update_csv_resource(
         resource,
         downloader,
-        adm1_json,
+        adm1_pop,
         updated_countries,
+        join(temp_folder, "population_by_adm1.csv"),
     )
-    updated_resource.to_csv(join(temp_folder, "population_by_adm1.csv"), index=False)
-
-    resource.set_file_to_upload(join(temp_folder, "population_by_adm1.csv"))
-    try:
-        resource.update_in_hdx()
-    except HDXError:
-        logger.exception("Could not update population resource")
-
-    return
+    if not updated_resource:
+        return False
+
+    resource.set_file_to_upload(updated_resource)
+    with stage("upload", resource=resource["name"]):
+        try:
+            resource.update_in_hdx()
+        except HDXError:
+            logger.exception("Could not update population resource")
+            return False
+
+    return True
+
+
+def find_population_resource(iso, exceptions, resource_exceptions):
+    dataset_name = exceptions.get(iso)
+    resource_name = resource_exceptions.get(iso)
+    if not resource_name:
+        resource_name = "adm(in)?1"
+    if not dataset_name:
+        dataset_name = f"cod-ps-{iso.lower()}"
+
+    pop_resource = find_resource(dataset_name, "csv", kw=resource_name)
+    if pop_resource:
+        return pop_resource, "csv"
+
+    dataset_name = f"worldpop-population-counts-for-{slugify(Country.get_country_name_from_iso3(iso))}"
+    pop_resource = find_resource(dataset_name, "geotiff", kw="(?<!\d)\d{4}_constrained")
+    if pop_resource:
+        return pop_resource, "geotiff"
+    return None
+
+
+def prefetch_population_resource(iso, exceptions, resource_exceptions):
+    # csv rows are streamed when they are read, so only rasters are downloaded ahead
+    pop_resource = find_population_resource(iso, exceptions, resource_exceptions)
+    if pop_resource and pop_resource[1] == "geotiff":
+        prefetch_resource(pop_resource[0][0])
+    return pop_resource
@@ -45,4 +45,4 @@ def update_un_boundaries(
 
         logger.info(f"Finished processing {dataset_name}")
 
-    return
+    return True
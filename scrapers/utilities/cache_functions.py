@@ -0,0 +1,203 @@
+import logging
+from glob import glob
+from hashlib import sha256
+from json import dump, load
+from os import listdir, makedirs, remove, replace, utime
+from os.path import getmtime, getsize, isdir, join
+from shutil import rmtree
+from geopandas import read_parquet
+from pyarrow import ArrowInvalid
+
+from hdx.utilities.uuid import get_uuid
+from scrapers.utilities.report_functions import stage
+
+logger = logging.getLogger()
+
+_cache = {"folder": None, "max_size": None, "offline": False, "parquet_layers": False}
+
+
+def setup_cache(cache_folder, max_size_gb=None, offline=False, parquet_layers=False):
+    if offline and not cache_folder:
+        logger.error("Cannot run offline without a cache folder - downloading as usual")
+        offline = False
+    _cache["folder"] = cache_folder
+    _cache["max_size"] = None
+    if max_size_gb:
+        _cache["max_size"] = int(max_size_gb * 1024 ** 3)
+    _cache["offline"] = offline
+    _cache["parquet_layers"] = parquet_layers
+    if not cache_folder:
+        return
+    makedirs(join(cache_folder, "datasets"), exist_ok=True)
+    makedirs(join(cache_folder, "layers"), exist_ok=True)
+    makedirs(join(cache_folder, "resources"), exist_ok=True)
+    if offline:
+        logger.info(f"Running offline from cache in {cache_folder}")
+    else:
+        logger.info(f"Caching downloads in {cache_folder}")
+
+
+def get_cache_settings():
+    return dict(_cache)
+
+
+def set_cache_settings(settings):
+    # used to give worker processes the same cache as the main process
+    _cache.update(settings)
+
+
+def cache_enabled():
+    return _cache["folder"] is not None
+
+
+def is_offline():
+    return _cache["offline"]
+
+
+def _resource_version(resource):
+    version = f"{resource.get('url')}|{resource.get('last_modified')}|{resource.get('hash')}"
+    return sha256(version.encode("utf-8")).hexdigest()[:16]
+
+
+def _folder_size(folder):
+    return sum(getsize(join(folder, f)) for f in listdir(folder))
+
+
+def read_cached_dataset(dataset_name):
+    try:
+        with open(join(_cache["folder"], "datasets", f"{dataset_name}.json")) as f:
+            return load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_cached_dataset(dataset_name, resources):
+    dataset_file = join(_cache["folder"], "datasets", f"{dataset_name}.json")
+    temp_file = f"{dataset_file}.{get_uuid()}"
+    with open(temp_file, "w") as f:
+        dump(resources, f)
+    replace(temp_file, dataset_file)
+
+
+def get_cached_resource(resource):
+    resource_folder = join(_cache["folder"], "resources", resource["id"])
+    if not isdir(resource_folder):
+        return None
+    if _cache["offline"]:
+        # any stored version will do, most recently used first
+        versions = [v for v in listdir(resource_folder) if not v.startswith(".")]
+        versions.sort(key=lambda v: getmtime(join(resource_folder, v)), reverse=True)
+    else:
+        versions = [_resource_version(resource)]
+    for version in versions:
+        version_folder = join(resource_folder, version)
+        if not isdir(version_folder):
+            continue
+        files = listdir(version_folder)
+        if len(files) != 1:
+            continue
+        utime(version_folder)
+        return join(version_folder, files[0])
+    return None
+
+
+def download_cached_resource(resource):
+    resource_folder = join(_cache["folder"], "resources", resource["id"])
+    version = _resource_version(resource)
+    # download next to the cache entry and only move it into place once complete
+    temp_folder = join(resource_folder, f".{version}-{get_uuid()}")
+    makedirs(temp_folder)
+    try:
+        _, resource_file = resource.download(folder=temp_folder)
+    except Exception:
+        rmtree(temp_folder, ignore_errors=True)
+        raise
+    version_folder = join(resource_folder, version)
+    for old_version in listdir(resource_folder):
+        if not old_version.startswith("."):
+            rmtree(join(resource_folder, old_version), ignore_errors=True)
+    replace(temp_folder, version_folder)
+    _evict(keep=version_folder)
+    return join(version_folder, listdir(version_folder)[0])
+
+
+def read_cached_layer(name, key):
+    if not cache_enabled():
+        return None
+    layer_file = join(_cache["folder"], "layers", f"{name}-{key}.parquet")
+    try:
+        lyr = read_parquet(layer_file)
+    except (FileNotFoundError, ArrowInvalid):
+        return None
+    utime(layer_file)
+    return lyr
+
+
+def write_cached_layer(name, key, lyr):
+    if not cache_enabled() or _cache["offline"]:
+        return
+    layers_folder = join(_cache["folder"], "layers")
+    layer_file = join(layers_folder, f"{name}-{key}.parquet")
+    temp_file = join(layers_folder, f".{name}-{key}-{get_uuid()}.parquet")
+    lyr.to_parquet(temp_file)
+    for old_file in glob(join(layers_folder, f"{name}-*.parquet")):
+        remove(old_file)
+    replace(temp_file, layer_file)
+    _evict(keep=layer_file)
+
+
+def read_cached_resource_layer(resource):
+    if not _cache["parquet_layers"]:
+        return None
+    with stage("read", resource=resource["name"], format="parquet") as record:
+        lyr = read_cached_layer(f"resource-{resource['id']}", _resource_version(resource))
+        if not isinstance(lyr, type(None)):
+            record["rows_out"] = len(lyr.index)
+    return lyr
+
+
+def write_cached_resource_layer(resource, lyr):
+    if not _cache["parquet_layers"]:
+        return
+    write_cached_layer(f"resource-{resource['id']}", _resource_version(resource), lyr)
+
+
+def _evict(keep=None):
+    if not _cache["max_size"]:
+        return
+    resources_folder = join(_cache["folder"], "resources")
+    entries = list()
+    for resource_id in listdir(resources_folder):
+        resource_folder = join(resources_folder, resource_id)
+        for version in listdir(resource_folder):
+            if version.startswith("."):
+                continue
+            version_folder = join(resource_folder, version)
+            try:
+                entries.append((getmtime(version_folder), _folder_size(version_folder), version_folder))
+            except FileNotFoundError:
+                continue
+    layers_folder = join(_cache["folder"], "layers")
+    for layer in listdir(layers_folder):
+        if layer.startswith("."):
+            continue
+        layer_file = join(layers_folder, layer)
+        try:
+            entries.append((getmtime(layer_file), getsize(layer_file), layer_file))
+        except FileNotFoundError:
+            continue
+    total_size = sum(entry[1] for entry in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= _cache["max_size"]:
+            break
+        if entry == keep:
+            continue
+        logger.info(f"Evicting {entry} from cache")
+        if isdir(entry):
+            rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                remove(entry)
+            except FileNotFoundError:
+                pass
+        total_size -= size
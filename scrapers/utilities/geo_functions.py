@@ -0,0 +1,103 @@
+import logging
+from hashlib import sha256
+from json import dumps as json_dumps
+from geopandas import GeoDataFrame
+from geopandas.array import GeometryArray
+from pandas import DataFrame
+from shapely.geometry import box
+from shapely.wkt import dumps
+
+logger = logging.getLogger()
+
+
+def clip_to_extent(lyr, extent_lyr):
+    # only keep features whose bounding boxes intersect the extent of the other layer
+    extent = box(*extent_lyr.total_bounds)
+    index = lyr.sindex.query(extent, predicate="intersects")
+    index.sort()
+    return lyr.iloc[index]
+
+
+def without_sindex(lyr):
+    # rtree spatial indexes come back empty once pickled, so layers sent to other processes share
+    # their attributes and geometries but not the index
+    lyr = lyr.copy(deep=False)
+    lyr[lyr.geometry.name] = GeometryArray(lyr.geometry.values.data, crs=lyr.crs)
+    return lyr
+
+
+def select_attributes(lyr, rows):
+    # copy the attribute columns of the selected rows, leaving the layer and its geometry untouched
+    columns = [c for c in lyr.columns if c != lyr.geometry.name]
+    return DataFrame(lyr.loc[rows, columns], copy=True)
+
+
+def index_adm0(adm0_lyr):
+    # map each country code to the positions of the features it is the owner or claimant of
+    adm0_index = dict()
+    for field in ["ISO_3", "Color_Code"]:
+        for iso, positions in adm0_lyr.groupby(field).indices.items():
+            adm0_index.setdefault(iso, set()).update(positions)
+    return adm0_index
+
+
+def select_adm0(adm0_lyr, adm0_index, isos):
+    positions = set()
+    for iso in isos:
+        positions.update(adm0_index.get(iso, []))
+    return adm0_lyr.take(sorted(positions))
+
+
+def geometry_key(geometry):
+    # geometries are normalized and their coordinates rounded, so that the key survives a round trip
+    # through GeoJSON or Mapbox, which can reorder or reverse rings and round coordinates
+    if geometry is None:
+        return ""
+    return dumps(geometry.normalize(), rounding_precision=6)
+
+
+def geometry_hash(lyr, key_field=None):
+    # features are sorted so that the hash does not depend on row order
+    if key_field:
+        keys = lyr[key_field]
+    else:
+        keys = [""] * len(lyr.index)
+    features = [f"{key}|{geometry_key(geometry)}" for key, geometry in zip(keys, lyr.geometry)]
+    digest = sha256()
+    for feature in sorted(features):
+        digest.update(feature.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def layer_hash(*lyrs, params=None):
+    # exact hash of attributes and geometries, used to key cached outputs
+    digest = sha256()
+    for lyr in lyrs:
+        attributes = DataFrame(lyr.drop(columns=lyr.geometry.name))
+        digest.update(attributes.to_json().encode("utf-8"))
+        for geometry in lyr.geometry:
+            if geometry is not None:
+                digest.update(geometry.wkb)
+    digest.update(json_dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def assign_slivers(slivers, units, fields):
+    # give each sliver to the single unit it shares the longest boundary with, breaking ties on the
+    # unit's fields so that the result does not depend on row order
+    sliver_index, unit_index = units.sindex.query_bulk(slivers.geometry, predicate="intersects")
+    sliver_boundaries = slivers.geometry.values[sliver_index].boundary
+    unit_boundaries = units.geometry.values[unit_index].boundary
+    candidates = DataFrame(units[fields].iloc[unit_index].values, columns=fields)
+    candidates["sliver"] = sliver_index
+    candidates["unit"] = unit_index
+    candidates["shared"] = sliver_boundaries.intersection(unit_boundaries).length
+    candidates = candidates.sort_values(
+        by=["sliver", "shared"] + fields, ascending=[True, False] + [True] * len(fields)
+    )
+    candidates = candidates.drop_duplicates(subset="sliver", keep="first")
+
+    assigned = units[fields].iloc[candidates["unit"].values].reset_index(drop=True)
+    return GeoDataFrame(
+        assigned, geometry=slivers.geometry.values[candidates["sliver"].values], crs=slivers.crs
+    )
@@ -1,44 +1,75 @@
 import logging
 import re
-from glob import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictWriter
+from functools import lru_cache
+from heapq import merge
+from itertools import islice
+from operator import itemgetter
 from os import remove
-from os.path import join, dirname
+from os.path import getsize
+from threading import Lock, local
+from time import monotonic, sleep
 from zipfile import ZipFile, BadZipFile
-from pandas import DataFrame, concat
-from geopandas import read_file
+from pandas import isna
+import fiona
+from geopandas import GeoDataFrame, read_file
 
 from hdx.data.dataset import Dataset
 from hdx.data.hdxobject import HDXError
+from hdx.data.resource import Resource
 from hdx.utilities.downloader import DownloadError
-from hdx.utilities.uuid import get_uuid
+from scrapers.utilities.cache_functions import (
+    cache_enabled,
+    download_cached_resource,
+    get_cached_resource,
+    is_offline,
+    read_cached_dataset,
+    read_cached_resource_layer,
+    write_cached_dataset,
+    write_cached_resource_layer,
+)
+from scrapers.utilities.report_functions import get_report_context, set_report_context, stage
 
 logger = logging.getLogger()
 
+# dataset metadata is looked up from HDX at most once per run
+_dataset_resources = dict()
+_dataset_lookups = {"cached": 0, "hdx": 0}
+_dataset_lock = Lock()
 
-def find_resource(dataset_name, file_type=None, kw=None):
-    try:
-        dataset = Dataset.read_from_hdx(dataset_name)
-    except HDXError:
-        logger.warning(f"Could not find dataset {dataset_name}")
-        return None
+# requests to HDX from every thread are spaced out by the same limit as the downloader
+_rate_limit = {"limit": None, "interval": 0, "next_call": 0}
+_rate_lock = Lock()
 
-    if not dataset:
+# files downloaded ahead of time, by resource id, until they are used
+_prefetched = dict()
+_prefetch_lock = Lock()
+_prefetch_thread = local()
+
+
+def find_resource(dataset_name, file_type=None, kw=None):
+    resources = read_dataset_resources(dataset_name)
+    if resources is None:
         logger.warning(f"Could not find dataset {dataset_name}")
         return None
 
-    resources = dataset.get_resources()
+    kw_regex = None
+    if kw:
+        kw_regex = _keyword_regex(kw)
     resource_list = []
     for r in resources:
         if file_type:
             if r.get_file_type().lower() == file_type.lower():
                 if kw:
-                    if bool(re.match(f".*{kw}.*", r["name"], re.IGNORECASE)):
+                    if bool(kw_regex.match(r["name"])):
                         resource_list.append(r)
                 else:
                     resource_list.append(r)
         else:
             if kw:
-                if bool(re.match(f".*{kw}.*", r["name"], re.IGNORECASE)):
+                if bool(kw_regex.match(r["name"])):
                     resource_list.append(r)
             else:
                 resource_list.append(r)
@@ -50,22 +81,240 @@ def find_resource(dataset_name, file_type=None, kw=None):
     return resource_list
 
 
-def download_unzip_read_data(resource, file_type=None, unzip=False, read=False):
+@lru_cache(maxsize=None)
+def _keyword_regex(kw):
+    return re.compile(f".*{kw}.*", re.IGNORECASE)
+
+
+def read_dataset_resources(dataset_name):
+    # threads that miss at the same time may both read the dataset, but only one copy is kept
+    with _dataset_lock:
+        cached = dataset_name in _dataset_resources
+        if cached:
+            _dataset_lookups["cached"] += 1
+            resources = _dataset_resources[dataset_name]
+        else:
+            _dataset_lookups["hdx"] += 1
+    if not cached:
+        resources = _read_dataset_resources(dataset_name)
+        with _dataset_lock:
+            resources = _dataset_resources.setdefault(dataset_name, resources)
+
+    if resources is None:
+        return None
+    # hand out new resource objects so that uploads do not change the cached metadata
+    return [Resource(r) for r in resources]
+
+
+def _read_dataset_resources(dataset_name):
+    if is_offline():
+        return read_cached_dataset(dataset_name)
+
     try:
+        wait_for_rate_limit()
+        dataset = Dataset.read_from_hdx(dataset_name)
+    except HDXError:
+        return None
+
+    if not dataset:
+        return None
+
+    resources = [r.data for r in dataset.get_resources()]
+    if cache_enabled():
+        write_cached_dataset(dataset_name, resources)
+    return resources
+
+
+def reset_dataset_lookups():
+    # each run looks datasets up again, as they may have changed on HDX since the last one
+    with _dataset_lock:
+        _dataset_resources.clear()
+        _dataset_lookups["cached"] = 0
+        _dataset_lookups["hdx"] = 0
+
+
+def log_dataset_lookups():
+    with _dataset_lock:
+        hdx_lookups = _dataset_lookups["hdx"]
+        cached_lookups = _dataset_lookups["cached"]
+    logger.info(f"Dataset lookups: {hdx_lookups} from HDX, {cached_lookups} cached")
+
+
+def set_rate_limit(rate_limit):
+    _rate_limit["limit"] = rate_limit
+    _rate_limit["interval"] = rate_limit["period"] / rate_limit["calls"]
+
+
+def get_rate_limit():
+    return _rate_limit["limit"]
+
+
+def wait_for_rate_limit():
+    with _rate_lock:
+        now = monotonic()
+        wait = _rate_limit["next_call"] - now
+        _rate_limit["next_call"] = max(now, _rate_limit["next_call"]) + _rate_limit["interval"]
+    if wait > 0:
+        sleep(wait)
+
+
+def download_resource(resource):
+    if not cache_enabled():
+        wait_for_rate_limit()
         _, resource_file = resource.download()
+        return resource_file
+
+    resource_file = get_cached_resource(resource)
+    if resource_file:
+        logger.info(f"Using cached copy of {resource['name']}")
+        return resource_file
+    if is_offline():
+        logger.error(f"No cached copy of {resource['name']} available offline")
+        return None
+    wait_for_rate_limit()
+    return download_cached_resource(resource)
+
+
+def _download_resource_file(resource):
+    # a prefetched file was already recorded as a download by the thread that fetched it
+    with _prefetch_lock:
+        prefetched = _prefetched.pop(resource["id"], None)
+    if prefetched:
+        return prefetched[0]
+    return _recorded_download(resource)
+
+
+def _recorded_download(resource):
+    with stage("download", resource=resource["name"]) as record:
+        resource_file = download_resource(resource)
+        if resource_file:
+            record["bytes_out"] = getsize(resource_file)
+    return resource_file
+
+
+def prefetch(items, fetch, depth=2, disk_budget_mb=None):
+    # run fetch for the next few items in background threads while the caller processes the
+    # current one, holding back while unused prefetched files take up more than the disk budget
+    if depth < 1:
+        for item in items:
+            yield item, _fetch(fetch, item)
+        return
+
+    budget = None
+    if disk_budget_mb:
+        budget = disk_budget_mb * 1024 ** 2
+    items = iter(items)
+    pending = deque()
+    owner = object()
+    try:
+        with ThreadPoolExecutor(
+            max_workers=depth,
+            initializer=_set_prefetch_owner,
+            initargs=(owner, get_report_context("scraper")),
+        ) as executor:
+            while True:
+                while len(pending) <= depth:
+                    if len(pending) > 0 and budget and _prefetched_size() >= budget:
+                        break
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.append((item, executor.submit(_fetch, fetch, item)))
+                if len(pending) == 0:
+                    return
+                item, future = pending.popleft()
+                yield item, future.result()
+    finally:
+        _discard_prefetched(owner)
+
+
+def _fetch(fetch, item):
+    # an item that cannot be fetched is handed to the caller as None, without stopping the rest
+    set_report_context(country=item)
+    try:
+        return fetch(item)
+    except Exception:
+        logger.exception(f"Could not fetch {item}")
+        return None
+
+
+def _set_prefetch_owner(owner, scraper):
+    _prefetch_thread.owner = owner
+    set_report_context(scraper=scraper)
+
+
+def prefetch_resource(resource):
+    try:
+        resource_file = _recorded_download(resource)
+    except DownloadError:
+        # the resource is downloaded again when it is used, and the error logged then
+        return None
+    if not resource_file:
+        return None
+    owner = getattr(_prefetch_thread, "owner", None)
+    with _prefetch_lock:
+        _prefetched[resource["id"]] = (resource_file, getsize(resource_file), owner)
+    return resource_file
+
+
+def _prefetched_size():
+    with _prefetch_lock:
+        return sum(size for _, size, _ in _prefetched.values())
+
+
+def _discard_prefetched(owner):
+    # remove the files that were prefetched but never used
+    with _prefetch_lock:
+        unused = [key for key, value in _prefetched.items() if value[2] is owner]
+        unused = [_prefetched.pop(key)[0] for key in unused]
+    if cache_enabled():
+        return
+    for resource_file in unused:
+        try:
+            remove(resource_file)
+        except OSError:
+            pass
+
+
+def download_unzip_read_data(
+    resource,
+    file_type=None,
+    unzip=False,
+    read=False,
+    columns=None,
+    bbox=None,
+    chunk_size=None,
+):
+    # whole layers can be kept as GeoParquet, which is much quicker to read than GeoJSON
+    whole_layer = read and columns is None and bbox is None and not chunk_size
+    if whole_layer:
+        lyr = read_cached_resource_layer(resource)
+        if not isinstance(lyr, type(None)):
+            logger.info(f"Using cached GeoParquet copy of {resource['name']}")
+            return lyr
+
+    try:
+        resource_file = _download_resource_file(resource)
     except DownloadError:
         logger.error(f"Could not download resource")
         return None
+    if not resource_file:
+        return None
 
     if unzip:
-        temp_folder = join(dirname(resource_file), get_uuid())
+        # read members straight from the zip rather than extracting it
         try:
             with ZipFile(resource_file, "r") as z:
-                z.extractall(temp_folder)
+                members = z.namelist()
         except BadZipFile:
             logger.error("Could not unzip file - it might not be a zip!")
             return None
-        out_files = glob(join(temp_folder, "**", f"*.{file_type}"), recursive=True)
+        out_files = [
+            f"zip://{resource_file}!{member}"
+            for member in members
+            if member.endswith(f".{file_type}")
+            and not any(part.startswith(".") for part in member.split("/"))
+        ]
     else:
         out_files = [resource_file]
 
@@ -77,27 +326,138 @@ def download_unzip_read_data(resource, file_type=None, unzip=False, read=False):
         if len(out_files) > 1:
             logger.error(f"Found more than one file for {resource['name']}")
             return None
-        lyr = read_file(out_files[0])
-        remove(out_files[0])
+        if chunk_size:
+            chunks = read_vector(out_files[0], columns=columns, bbox=bbox, chunk_size=chunk_size)
+            return _read_chunks(resource, resource_file, chunks)
+        with stage("read", resource=resource["name"]) as record:
+            lyr = read_vector(out_files[0], columns=columns, bbox=bbox)
+            record["rows_out"] = len(lyr.index)
+        if whole_layer:
+            write_cached_resource_layer(resource, lyr)
+        if not cache_enabled():
+            remove(resource_file)
         return lyr
 
     return out_files
 
 
-def update_csv_resource(resource, downloader, new_adm1_data, countries):
+def _read_chunks(resource, resource_file, chunks):
+    # chunks are only read as they are used, so the file is removed once they have all been read
     try:
-        orig_data = downloader.download_tabular_rows_as_dicts(resource["url"])
+        while True:
+            with stage("read", resource=resource["name"]) as record:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    record["rows_out"] = len(chunk.index)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+        if not cache_enabled():
+            remove(resource_file)
+
+
+def zip_member_name(path):
+    return path.split("!", 1)[-1]
+
+
+def remove_unzipped_download(out_files):
+    # files read straight from a downloaded zip are only removed once the caller has read them
+    if cache_enabled():
+        return
+    zip_files = {f[len("zip://"):].split("!", 1)[0] for f in out_files if f.startswith("zip://")}
+    for zip_file in zip_files:
+        try:
+            remove(zip_file)
+        except OSError:
+            pass
+
+
+def read_vector(path, columns=None, bbox=None, chunk_size=None):
+    # only parse the requested attribute columns, and features within the bbox
+    kwargs = dict()
+    if bbox is not None:
+        kwargs["bbox"] = tuple(bbox)
+    if columns is not None:
+        with fiona.open(path) as src:
+            fields = list(src.schema["properties"])
+        kwargs["ignore_fields"] = [f for f in fields if f not in columns]
+
+    if not chunk_size:
+        return _project_columns(read_file(path, **kwargs), columns)
+    return _read_vector_chunks(path, chunk_size, columns, **kwargs)
+
+
+def _read_vector_chunks(path, chunk_size, columns, bbox=None, ignore_fields=None):
+    # features are read in a single pass, in layers of at most chunk_size rows
+    with fiona.open(path, ignore_fields=ignore_fields) as src:
+        fields = [f for f in src.schema["properties"] if f not in (ignore_fields or [])]
+        features = src.filter(bbox=bbox)
+        while True:
+            batch = list(islice(features, chunk_size))
+            if len(batch) == 0:
+                return
+            lyr = GeoDataFrame.from_features(batch, crs=src.crs_wkt, columns=fields + ["geometry"])
+            yield _project_columns(lyr, columns)
+
+
+def _project_columns(lyr, columns):
+    if columns is None:
+        return lyr
+    return lyr[[c for c in lyr.columns if c in columns or c == lyr.geometry.name]]
+
+
+def get_tabular_rows(downloader, resource):
+    # with a cache, tables are read from the cached copy so that offline runs never use HDX
+    if not cache_enabled():
+        return downloader.get_tabular_rows(resource["url"], dict_form=True)
+    resource_file = _download_resource_file(resource)
+    if not resource_file:
+        raise DownloadError(f"No copy of {resource['name']} available")
+    return downloader.get_tabular_rows(resource_file, dict_form=True)
+
+
+def update_csv_resource(resource, downloader, new_adm1_data, countries, out_file):
+    try:
+        headers, iterator = get_tabular_rows(downloader, resource)
     except DownloadError:
         logger.error(f"Could not download {resource['name']}")
         return None
 
-    orig_data = DataFrame.from_dict(orig_data, orient="index")
-    orig_data["ADM1_PCODE"] = orig_data.index
-    orig_data.index.names = ["ADM1_PCODE"]
-    orig_data.drop(orig_data.index[orig_data["alpha_3"].isin(countries)], inplace=True)
-    new_adm1_data.drop(new_adm1_data.index[~new_adm1_data["alpha_3"].isin(countries)], inplace=True)
+    # both the existing csv and the new rows are sorted by pcode, so they can be merged as a stream
+    new_adm1_data = new_adm1_data[new_adm1_data["alpha_3"].isin(countries)]
+    new_adm1_data = new_adm1_data.sort_values(by=["ADM1_PCODE"])
+    fieldnames = list(new_adm1_data.columns)
+    fieldnames.extend(h for h in headers if h not in fieldnames)
+    new_rows = new_adm1_data.to_dict("records")
+    orig_rows = (row for row in iterator if row["alpha_3"] not in countries)
+    rows = merge(new_rows, orig_rows, key=itemgetter("ADM1_PCODE"))
+    if write_sorted_rows(rows, fieldnames, out_file):
+        return out_file
+
+    # otherwise the existing csv is read again and all rows are sorted in memory
+    logger.warning(f"{resource['name']} is not sorted by pcode - sorting it in memory")
+    try:
+        _, iterator = get_tabular_rows(downloader, resource)
+    except DownloadError:
+        logger.error(f"Could not download {resource['name']}")
+        return None
+    orig_rows = [row for row in iterator if row["alpha_3"] not in countries]
+    rows = sorted(new_rows + orig_rows, key=itemgetter("ADM1_PCODE"))
+    write_sorted_rows(rows, fieldnames, out_file)
+    return out_file
 
-    adm1_data = concat([new_adm1_data, orig_data])
-    adm1_data.sort_values(by=["ADM1_PCODE"], inplace=True)
 
-    return adm1_data
+def write_sorted_rows(rows, fieldnames, out_file):
+    # stops and returns False at the first row that is out of pcode order
+    last_pcode = None
+    with open(out_file, "w", newline="") as f:
+        writer = DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            if last_pcode is not None and row["ADM1_PCODE"] < last_pcode:
+                return False
+            last_pcode = row["ADM1_PCODE"]
+            writer.writerow({key: "" if isna(value) else value for key, value in row.items()})
+    return True
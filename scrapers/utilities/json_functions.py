@@ -1,17 +1,25 @@
 import logging
-from json import dump
-from os import remove
+from json import dump, load
+from os import replace
 
 logger = logging.getLogger()
 
 
 def replace_json(new_data, data_path):
+    # write to a temporary file first so that an interrupted run never leaves a partial file
+    temp_path = f"{data_path}.tmp"
+    with open(temp_path, "w") as f_open:
+        dump(new_data, f_open)
+    replace(temp_path, data_path)
+
+
+def read_json(data_path):
     try:
-        remove(data_path)
+        with open(data_path) as f_open:
+            return load(f_open)
     except FileNotFoundError:
-        logger.info("File does not exist - creating!")
-    with open(data_path, "w") as f_open:
-        dump(new_data, f_open)
+        logger.info("File does not exist - starting empty!")
+        return dict()
 
 
 def drop_fields(df, keep_fields):
@@ -1,14 +1,31 @@
 import logging
-from os.path import join
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os.path import getsize, join
 from mapbox import Uploader, Datasets
+from threading import BoundedSemaphore, local
 from time import sleep
 from geojson import loads, load
 from geopandas import GeoDataFrame
+from pandas import concat
+from requests.exceptions import RequestException
+from shapely.geometry import shape
+
+from scrapers.utilities.geo_functions import geometry_key
+from scrapers.utilities.report_functions import stage
 
 logger = logging.getLogger()
 
+# limits the number of requests made to the Mapbox API at the same time
+mapbox_requests = BoundedSemaphore(4)
+
+# requests sessions are not thread safe, so each upload thread sends through its own client
+_upload_thread = local()
 
-def replace_mapbox_dataset(mapid, mapbox_auth, path_to_upload=None, json_to_upload=None):
+
+def replace_mapbox_dataset(
+    mapid, mapbox_auth, path_to_upload=None, json_to_upload=None, key_field="ADM1_PCODE", workers=4
+):
     datasets = Datasets(access_token=mapbox_auth)
     data_to_upload = None
     if not isinstance(path_to_upload, type(None)):
@@ -20,45 +37,142 @@ def replace_mapbox_dataset(mapid, mapbox_auth, path_to_upload=None, json_to_uplo
     if not data_to_upload:
         logger.error("No data to upload!")
         return None
-    response = datasets.list_features(dataset=mapid)
-    if response.status_code != 200:
-        logger.error(f"Could not retrieve dataset {mapid}: error {response.status_code}")
-        return None
-    feature_list = response.json()
-    if len(feature_list["features"]) > 0:
-        for feature in feature_list["features"]:
-            fid = feature["id"]
-            response = datasets.delete_feature(mapid, fid)
-            if response.status_code != 204:
-                logger.warning(f"Feature {fid} may not have been deleted from {mapid}: error {response.status_code}")
-    for i in range(len(data_to_upload["features"])):
-        fid = str(i+1)
-        response = datasets.update_feature(mapid, fid, data_to_upload["features"][i])
-        if response.status_code != 200:
-            logger.error(f"Could not update feature {i} in dataset {mapid}: error {response.status_code}")
+
+    existing_features = list()
+    for feature_list in list_mapbox_features(datasets, mapid):
+        if isinstance(feature_list, type(None)):
+            return None
+        existing_features.extend(feature_list)
+
+    # match features on pcode and geometry so that only changed features are sent
+    old_features = dict()
+    for feature in existing_features:
+        old_features.setdefault(_feature_key(feature, key_field), []).append(feature)
+    next_fid = max([_feature_order(f["id"])[1] for f in existing_features] + [0]) + 1
+
+    updates = list()
+    added = 0
+    changed = 0
+    for feature in data_to_upload["features"]:
+        matches = old_features.get(_feature_key(feature, key_field))
+        if matches:
+            old_feature = matches.pop(0)
+            if old_feature["properties"] != feature["properties"]:
+                updates.append((old_feature["id"], feature))
+                changed += 1
+            continue
+        updates.append((str(next_fid), feature))
+        next_fid += 1
+        added += 1
+    deletes = [f["id"] for matches in old_features.values() for f in matches]
+
+    with stage("upload", dataset=mapid, rows_in=len(updates) + len(deletes)):
+        with ThreadPoolExecutor(
+            max_workers=workers, initializer=_set_upload_client, initargs=(mapbox_auth,)
+        ) as executor:
+            delete_futures = {
+                fid: executor.submit(_send_with_retry, "delete_feature", 204, mapid, fid)
+                for fid in deletes
+            }
+            update_futures = {
+                fid: executor.submit(_send_with_retry, "update_feature", 200, mapid, fid, feature)
+                for fid, feature in updates
+            }
+            for fid, future in delete_futures.items():
+                status_code = future.result()
+                if status_code != 204:
+                    logger.warning(f"Feature {fid} may not have been deleted from {mapid}: error {status_code}")
+            for fid, future in update_futures.items():
+                status_code = future.result()
+                if status_code != 200:
+                    logger.error(f"Could not update feature {fid} in dataset {mapid}: error {status_code}")
+
+    logger.info(
+        f"Updated dataset {mapid}: {added} added, {changed} changed, {len(deletes)} deleted"
+    )
     return None
 
 
+def _feature_key(feature, key_field):
+    # a feature read back from Mapbox matches the one uploaded even if its coordinates were
+    # reordered or rounded
+    geometry = ""
+    if feature.get("geometry"):
+        geometry = geometry_key(shape(feature["geometry"]))
+    properties = feature.get("properties") or {}
+    return properties.get(key_field), sha256(geometry.encode("utf-8")).hexdigest()
+
+
+def _set_upload_client(mapbox_auth):
+    _upload_thread.datasets = Datasets(access_token=mapbox_auth)
+
+
+def _send_with_retry(method, expected_status, *args, retries=5):
+    request = getattr(_upload_thread.datasets, method)
+    status_code = None
+    for attempt in range(retries):
+        if attempt > 0:
+            sleep(2 ** attempt)
+        try:
+            with mapbox_requests:
+                response = request(*args)
+        except RequestException:
+            continue
+        status_code = response.status_code
+        if status_code == expected_status:
+            break
+        # only retry when rate limited or when Mapbox has a server error
+        if status_code != 429 and status_code < 500:
+            break
+    return status_code
+
+
 def download_from_mapbox(mapid, mapbox_auth):
     datasets = Datasets(access_token=mapbox_auth)
-    feature_list = {"type": "FeatureCollection",
-                    "features": []}
-    nogos_in_a_row = 0
-    for i in range(1000):
-        response = datasets.read_feature(dataset=mapid, fid=str(i))
-        if response.status_code == 200:
-            nogos_in_a_row = 0
-            feature_list["features"].append(response.json())
-        else:
-            nogos_in_a_row += 1
-        if nogos_in_a_row >= 10:
-            break
+    pages = list()
+    feature_ids = list()
+    with stage("download", dataset=mapid) as record:
+        for feature_list in list_mapbox_features(datasets, mapid):
+            if isinstance(feature_list, type(None)):
+                return None
+            pages.append(GeoDataFrame.from_features(feature_list))
+            feature_ids.extend(feature["id"] for feature in feature_list)
+        record["rows_out"] = len(feature_ids)
+
+    if len(pages) == 0:
+        return GeoDataFrame.from_features([])
 
-    features = GeoDataFrame.from_features(feature_list["features"])
+    # keep features in id order, as they were uploaded
+    features = concat(pages, ignore_index=True)
+    order = sorted(range(len(feature_ids)), key=lambda i: _feature_order(feature_ids[i]))
+    features = features.take(order).reset_index(drop=True)
 
     return features
 
 
+def list_mapbox_features(datasets, mapid, page_size=100):
+    start = None
+    while True:
+        with mapbox_requests:
+            response = datasets.list_features(mapid, start=start, limit=page_size)
+        if response.status_code != 200:
+            logger.error(f"Could not retrieve dataset {mapid}: error {response.status_code}")
+            yield None
+            return
+        feature_list = response.json()["features"]
+        if len(feature_list) > 0:
+            yield feature_list
+        if len(feature_list) < page_size:
+            return
+        start = feature_list[-1]["id"]
+
+
+def _feature_order(fid):
+    if str(fid).isdigit():
+        return 0, int(fid), ""
+    return 1, 0, str(fid)
+
+
 def replace_mapbox_tileset(mapid, mapbox_auth, name, path_to_upload=None, json_to_upload=None, temp_folder=None):
     service = Uploader(access_token=mapbox_auth)
     saved_file = None
@@ -73,15 +187,16 @@ def replace_mapbox_tileset(mapid, mapbox_auth, name, path_to_upload=None, json_t
     if not saved_file:
         logger.error("No saved file to upload!")
         return None
-    with open(saved_file, 'rb') as src:
-        upload_resp = service.upload(src, mapid, name=name)
-    if upload_resp.status_code == 422:
-        for i in range(5):
-            sleep(5)
-            with open(saved_file, 'rb') as src:
-                upload_resp = service.upload(src, mapid, name=name)
-            if upload_resp.status_code != 422:
-                break
+    with stage("upload", tileset=mapid, bytes_in=getsize(saved_file)):
+        with open(saved_file, 'rb') as src:
+            upload_resp = service.upload(src, mapid, name=name)
+        if upload_resp.status_code == 422:
+            for i in range(5):
+                sleep(5)
+                with open(saved_file, 'rb') as src:
+                    upload_resp = service.upload(src, mapid, name=name)
+                if upload_resp.status_code != 422:
+                    break
     if upload_resp.status_code == 422:
         logger.error(f"Could not upload {name}")
         return None
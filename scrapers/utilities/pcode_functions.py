@@ -0,0 +1,42 @@
+import logging
+from pandas import Series
+
+logger = logging.getLogger()
+
+
+def find_attribute_fields(fields, attribute_mappings):
+    pcode_field = None
+    name_field = None
+    if "ADM1_PCODE" in fields:
+        pcode_field = "ADM1_PCODE"
+    if "ADM1_EN" in fields:
+        name_field = "ADM1_EN"
+    for field in fields:
+        if not pcode_field:
+            if field.upper() in attribute_mappings["pcode"]:
+                pcode_field = field
+        if not name_field:
+            if field.upper() in attribute_mappings["name"]:
+                name_field = field
+    return pcode_field, name_field
+
+
+def build_pcodes(adm0_pcodes, codes):
+    # prefix numeric codes with the country code, padded to the number of digits in the row count
+    width = len(str(len(codes)))
+    return adm0_pcodes + codes.astype(int).astype(str).str.zfill(width)
+
+
+def build_sequential_pcodes(adm0_pcodes):
+    codes = Series(range(1, len(adm0_pcodes) + 1), index=adm0_pcodes.index)
+    return build_pcodes(adm0_pcodes, codes)
+
+
+def normalize_names(names):
+    # remove characters that break the lookup files and strip accents
+    names = (
+        names.str.replace("-", " ", regex=False)
+        .str.replace("`", "", regex=False)
+        .str.replace("'", "", regex=False)
+    )
+    return names.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
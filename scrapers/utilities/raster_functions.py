@@ -0,0 +1,115 @@
+import logging
+import numpy as np
+import rasterio
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import count
+from math import ceil, floor
+from multiprocessing import get_context
+from rasterio.features import geometry_mask
+from rasterio.windows import Window
+from shapely.geometry import mapping
+
+logger = logging.getLogger()
+
+# the raster each worker has open, reopened when a call sums a different one
+_raster = {"call": None, "src": None}
+_calls = count()
+
+
+def raster_pool(workers):
+    # workers are spawned rather than forked from this process, where other scrapers may be holding
+    # locks, and the pool is reused for every raster as starting it is slow
+    if workers <= 1:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+
+
+def zonal_sums(polygons, raster_path, workers=1, all_touched=False, pool=None):
+    geometries = list(polygons)
+    if workers <= 1 or len(geometries) <= 1:
+        with rasterio.open(raster_path) as src:
+            return [polygon_sum(src, geometry, all_touched) for geometry in geometries]
+
+    if not pool:
+        with raster_pool(workers) as pool:
+            return zonal_sums(geometries, raster_path, workers, all_touched, pool)
+
+    call = (next(_calls), raster_path, all_touched)
+    chunksize = max(len(geometries) // (workers * 4), 1)
+    return list(pool.map(partial(_polygon_sum_in_worker, call), geometries, chunksize=chunksize))
+
+
+def _polygon_sum_in_worker(call, geometry):
+    if _raster["call"] != call:
+        if _raster["src"]:
+            _raster["src"].close()
+        _raster["src"] = rasterio.open(call[1])
+        _raster["call"] = call
+    return polygon_sum(_raster["src"], geometry, call[2])
+
+
+def polygon_sum(src, geometry, all_touched=False):
+    pixels = _pixel_bounds(src, geometry.bounds)
+    window = _block_window(src, pixels)
+    if not window:
+        return None
+
+    # rasterize the polygon once over its whole window, then sum the raster strip by strip
+    mask = geometry_mask(
+        [mapping(geometry)],
+        out_shape=(window.height, window.width),
+        transform=src.window_transform(window),
+        all_touched=all_touched,
+        invert=True,
+    )
+    # as in rasterstats, pixels touched outside the polygon bounds are not counted
+    row_start, col_start, row_stop, col_stop = pixels
+    mask[: max(row_start - window.row_off, 0)] = False
+    mask[max(row_stop - window.row_off, 0):] = False
+    mask[:, : max(col_start - window.col_off, 0)] = False
+    mask[:, max(col_stop - window.col_off, 0):] = False
+    strip_height = src.block_shapes[0][0]
+    total = 0.0
+    count = 0
+    for row in range(0, window.height, strip_height):
+        height = min(strip_height, window.height - row)
+        strip_mask = mask[row:row + height]
+        if not strip_mask.any():
+            continue
+        strip = Window(window.col_off, window.row_off + row, window.width, height)
+        values = src.read(1, window=strip, masked=True)[strip_mask]
+        values = np.ma.masked_invalid(values)
+        if values.count() == 0:
+            continue
+        total += float(values.sum(dtype="float64"))
+        count += values.count()
+
+    if count == 0:
+        return None
+    return total
+
+
+def _pixel_bounds(src, bounds):
+    # rows and columns of the pixels overlapping the polygon bounds, which may be off the raster
+    left, bottom, right, top = bounds
+    transform = src.transform
+    row_start = floor((top - transform.f) / transform.e)
+    col_start = floor((left - transform.c) / transform.a)
+    row_stop = ceil((bottom - transform.f) / transform.e)
+    col_stop = ceil((right - transform.c) / transform.a)
+    return row_start, col_start, row_stop, col_stop
+
+
+def _block_window(src, pixels):
+    # expand the polygon pixels outwards to whole raster blocks, clipped to the raster
+    row_start, col_start, row_stop, col_stop = pixels
+    block_height, block_width = src.block_shapes[0]
+    row_start = max(floor(row_start / block_height) * block_height, 0)
+    col_start = max(floor(col_start / block_width) * block_width, 0)
+    row_stop = min(ceil(row_stop / block_height) * block_height, src.height)
+    col_stop = min(ceil(col_stop / block_width) * block_width, src.width)
+    if row_stop <= row_start or col_stop <= col_start:
+        return None
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
@@ -0,0 +1,131 @@
+import logging
+from contextlib import contextmanager
+from json import dump
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from threading import Lock, local
+from time import perf_counter, thread_time
+
+logger = logging.getLogger()
+
+_report = {"enabled": False, "stages": list(), "http_calls": 0}
+_report_lock = Lock()
+_context = local()
+
+
+def enable_report():
+    if _report["enabled"]:
+        return
+    _report["enabled"] = True
+    _count_http_calls()
+
+
+def report_enabled():
+    return _report["enabled"]
+
+
+def _count_http_calls():
+    # every HDX and Mapbox request goes through a requests adapter; calls are also counted per
+    # thread so that a stage only counts the requests made by its own thread
+    from requests.adapters import HTTPAdapter
+
+    send = HTTPAdapter.send
+
+    def counted_send(self, *args, **kwargs):
+        with _report_lock:
+            _report["http_calls"] += 1
+        _context.http_calls = _thread_http_calls() + 1
+        return send(self, *args, **kwargs)
+
+    HTTPAdapter.send = counted_send
+
+
+def _thread_http_calls():
+    return getattr(_context, "http_calls", 0)
+
+
+def set_report_context(**context):
+    for key, value in context.items():
+        setattr(_context, key, value)
+
+
+def get_report_context(key):
+    return getattr(_context, key, None)
+
+
+@contextmanager
+def stage(name, **details):
+    if not _report["enabled"]:
+        yield dict()
+        return
+
+    record = {
+        "stage": name,
+        "scraper": get_report_context("scraper"),
+        "country": get_report_context("country"),
+    }
+    record.update(details)
+    # cpu time and http calls are those of the current thread, as other scrapers and prefetches
+    # run at the same time; memory is the peak of the whole process so far, not of the stage
+    http_calls = _thread_http_calls()
+    child_cpu = _child_cpu_time()
+    cpu = thread_time()
+    wall = perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_time"] = perf_counter() - wall
+        record["cpu_time"] = thread_time() - cpu
+        record["child_cpu_time"] = _child_cpu_time() - child_cpu
+        record["process_peak_rss_mb"] = getrusage(RUSAGE_SELF).ru_maxrss / 1024
+        record["http_calls"] = _thread_http_calls() - http_calls
+        with _report_lock:
+            _report["stages"].append(record)
+
+
+def _child_cpu_time():
+    usage = getrusage(RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def pop_report_stages():
+    # used to hand the stages recorded in a worker process back to the main process
+    with _report_lock:
+        stages = _report["stages"]
+        _report["stages"] = list()
+    return stages
+
+
+def add_report_stages(stages):
+    with _report_lock:
+        _report["stages"].extend(stages)
+
+
+def summarize_stages(stages):
+    summary = dict()
+    for record in stages:
+        totals = summary.setdefault(str(record["scraper"]), dict()).setdefault(
+            record["stage"],
+            {"count": 0, "wall_time": 0, "cpu_time": 0, "http_calls": 0},
+        )
+        totals["count"] += 1
+        for key in ["wall_time", "cpu_time", "http_calls"]:
+            totals[key] += record[key]
+    return summary
+
+
+def write_report(report_file):
+    if not _report["enabled"]:
+        return
+
+    with open(report_file, "w") as f:
+        dump(
+            {
+                "peak_rss_mb": getrusage(RUSAGE_SELF).ru_maxrss / 1024,
+                "http_calls": _report["http_calls"],
+                "summary": summarize_stages(_report["stages"]),
+                "stages": _report["stages"],
+            },
+            f,
+            indent=1,
+        )
+    logger.info(f"Wrote run report to {report_file}")
@@ -0,0 +1,81 @@
+from os import makedirs
+from os.path import basename, join
+from shutil import copyfile
+
+import pytest
+
+from hdx.api.configuration import Configuration
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.utilities.downloader import Download
+from scrapers.utilities.cache_functions import setup_cache
+from scrapers.utilities.hdx_functions import reset_dataset_lookups
+
+
+class LocalDataset:
+    def __init__(self, resources):
+        self.resources = resources
+
+    def get_resources(self):
+        return [Resource(r) for r in self.resources]
+
+
+class LocalHDX:
+    # stand-in for HDX that serves datasets and resources from a local folder, recording each call
+    def __init__(self, folder):
+        self.folder = folder
+        self.datasets = dict()
+        self.calls = list()
+        makedirs(join(folder, "hdx"))
+        makedirs(join(folder, "downloads"))
+
+    def add_resource(self, dataset_name, name, file_type, content):
+        path = join(self.folder, "hdx", name)
+        with open(path, "w") as f:
+            f.write(content)
+        resource = {
+            "id": f"{dataset_name}-{name}",
+            "name": name,
+            "format": file_type,
+            "url": path,
+            "last_modified": "2022-01-01T00:00:00",
+        }
+        self.datasets.setdefault(dataset_name, []).append(resource)
+        return resource
+
+    def read_from_hdx(self, dataset_name):
+        self.calls.append(("dataset", dataset_name))
+        if dataset_name not in self.datasets:
+            return None
+        return LocalDataset(self.datasets[dataset_name])
+
+    def download(self, resource, folder=None):
+        self.calls.append(("resource", resource["name"]))
+        if not folder:
+            folder = join(self.folder, "downloads")
+        path = join(folder, basename(resource["url"]))
+        copyfile(resource["url"], path)
+        return resource["url"], path
+
+
+@pytest.fixture(scope="session")
+def configuration():
+    Configuration._create(hdx_site="stage", user_agent="test", hdx_read_only=True)
+    return Configuration.read()
+
+
+@pytest.fixture
+def local_hdx(tmp_path, monkeypatch, configuration):
+    hdx = LocalHDX(str(tmp_path))
+    monkeypatch.setattr(Dataset, "read_from_hdx", staticmethod(hdx.read_from_hdx))
+    monkeypatch.setattr(Resource, "download", lambda self, folder=None: hdx.download(self, folder))
+    reset_dataset_lookups()
+    yield hdx
+    reset_dataset_lookups()
+    setup_cache(None)
+
+
+@pytest.fixture
+def downloader():
+    with Download(user_agent="test") as downloader:
+        yield downloader
@@ -0,0 +1,253 @@
+from glob import glob
+from json import load
+from os import makedirs
+from os.path import basename, join
+from zipfile import ZipFile
+
+import pytest
+from geopandas import read_file
+from geopandas.testing import assert_geodataframe_equal
+from shapely.geometry import MultiPolygon, Polygon
+
+from hdx.data.resource import Resource
+from benchmarks.run_benchmarks import (
+    BenchmarkDownloader,
+    BenchmarkResource,
+    benchmark_configuration,
+    stubbed_hdx,
+)
+from benchmarks.synthetic_data import boundaries_dataset, generate_world
+from scrapers import boundaries
+from scrapers.boundaries import process_admin1_boundaries, update_boundaries
+from scrapers.main import boundaries_layers, load_global_layers
+from scrapers.utilities.geo_functions import index_adm0
+
+attribute_mappings = {"pcode": ["ADM1_PCODE", "ADM1_ID"], "name": ["ADM1_EN"]}
+req_fields = ["alpha_3", "ADM0_REF", "ADM0_PCODE", "ADM1_REF", "ADM1_PCODE"]
+
+
+@pytest.fixture(scope="module")
+def world(tmp_path_factory):
+    return generate_world(
+        str(tmp_path_factory.mktemp("world")), countries=3, vertices=60, admin1=4, lakes=20
+    )
+
+
+def global_layer(world, name):
+    return read_file(world["files"][f"{boundaries_dataset}/{name}"])
+
+
+@pytest.fixture
+def local_boundaries(world, monkeypatch):
+    # boundary resources are the paths of the countries' shapefiles
+    monkeypatch.setattr(
+        boundaries, "download_unzip_read_data", lambda resource, file_type, unzip: [resource]
+    )
+    return [
+        (iso, world["files"][f"cod-ab-{iso.lower()}/{iso.lower()}_adm_20220101_shp.zip"])
+        for iso in world["countries"]
+    ]
+
+
+def boundaries_args(world):
+    adm0_json = global_layer(world, "polbnda_int_1m_uncs.geojson")
+    water_json = global_layer(world, "wrl_lake_1m_uncs.geojson")
+    water_json.sindex
+    return attribute_mappings, adm0_json, index_adm0(adm0_json), water_json, req_fields
+
+
+def test_workers_process_boundaries_like_one_process(world, local_boundaries):
+    args = boundaries_args(world)
+    water_json = args[3]
+
+    serial = process_admin1_boundaries(local_boundaries, 1, *args)
+    parallel = process_admin1_boundaries(local_boundaries, 2, *args)
+
+    assert list(parallel) == list(serial) == world["countries"]
+    for iso in world["countries"]:
+        assert len(serial[iso].index) == 4
+        assert_geodataframe_equal(parallel[iso], serial[iso])
+    # the layers sent to the workers still have their own spatial index
+    assert water_json.has_sindex
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_downloaded_zips_removed_once_processed(world, local_hdx, workers):
+    resources = list()
+    for iso in world["countries"]:
+        name = f"{iso.lower()}_admbnda_adm1_20220101"
+        resource = local_hdx.add_resource(f"cod-ab-{iso.lower()}", f"{name}_shp.zip", "SHP", "")
+        shp_file = world["files"][f"cod-ab-{iso.lower()}/{iso.lower()}_adm_20220101_shp.zip"]
+        with ZipFile(resource["url"], "w") as z:
+            for path in glob(shp_file[: -len(".shp")] + ".*"):
+                z.write(path, basename(path))
+        resources.append((iso, Resource(resource)))
+
+    boundary_lyrs = process_admin1_boundaries(resources, workers, *boundaries_args(world))
+
+    assert all(len(boundary_lyrs[iso].index) == 4 for iso in world["countries"])
+    assert glob(join(local_hdx.folder, "downloads", "*")) == []
+
+
+def mapbox_round_trip(geometry):
+    # Mapbox can hand rings back reversed and starting from another vertex
+    def ring(coords):
+        coords = list(coords)[1:]
+        coords.reverse()
+        return coords + coords[:1]
+
+    polygons = [geometry]
+    if isinstance(geometry, MultiPolygon):
+        polygons = list(geometry.geoms)
+    polygons = [
+        Polygon(ring(p.exterior.coords), [ring(i.coords) for i in p.interiors]) for p in polygons
+    ]
+    if isinstance(geometry, MultiPolygon):
+        return MultiPolygon(polygons)
+    return polygons[0]
+
+
+class IncrementalRuns:
+    # runs update_boundaries incrementally on the synthetic world, publishing the admin1 layer that
+    # the next run starts from and recording the countries processed
+    def __init__(self, world, folder, monkeypatch):
+        self.world = world
+        self.folder = folder
+        self.processed = list()
+        self.failing = set()
+        self.interrupt_at = None
+        self.configuration = benchmark_configuration(world)
+        with stubbed_hdx(world):
+            self.global_layers = load_global_layers(
+                self.configuration, "hdx", None, ["polbnda_adm1"] + boundaries_layers
+            )
+        process_country_boundaries = boundaries.process_country_boundaries
+
+        def process(iso, *args):
+            if iso == self.interrupt_at:
+                raise KeyboardInterrupt
+            self.processed.append(iso)
+            if iso in self.failing:
+                return None
+            return process_country_boundaries(iso, *args)
+
+        monkeypatch.setattr(boundaries, "process_country_boundaries", process)
+        monkeypatch.chdir(folder)
+        makedirs("saved_outputs")
+        makedirs("outputs")
+
+    def run(self):
+        self.processed.clear()
+        with stubbed_hdx(self.world):
+            assert update_boundaries(
+                self.configuration,
+                BenchmarkDownloader(self.world),
+                None,
+                "outputs",
+                self.global_layers,
+                "hdx",
+                False,
+                ["benchmark"],
+                self.world["countries"],
+                1,
+                True,
+            ) is True
+        published = join("outputs", "polbnda_adm1_1m_ocha.geojson")
+        self.global_layers["polbnda_adm1"] = read_file(published)
+        return list(self.processed)
+
+    def update_source(self, iso, monkeypatch):
+        # a new version of the country's COD-AB, with its units moved slightly
+        resource = self.world["resources"][f"cod-ab-{iso.lower()}"][0]
+        cod_lyr = read_file(self.world["files"][resource["id"]])
+        cod_lyr["geometry"] = cod_lyr.translate(0.01, 0.01)
+        cod_file = join(self.folder, f"{iso.lower()}_admbnda_adm1_20220601.shp")
+        cod_lyr.to_file(cod_file)
+        monkeypatch.setitem(self.world["files"], resource["id"], cod_file)
+        monkeypatch.setitem(resource, "last_modified", "2022-06-01T00:00:00")
+
+    def manifest(self):
+        with open(join("saved_outputs", "boundaries-manifest.json")) as f:
+            return load(f)
+
+
+@pytest.fixture
+def incremental_runs(world, tmp_path, monkeypatch):
+    return IncrementalRuns(world, tmp_path, monkeypatch)
+
+
+def test_unchanged_countries_skipped(world, incremental_runs):
+    assert incremental_runs.run() == world["countries"]
+    assert sorted(incremental_runs.manifest()) == world["countries"]
+
+    assert incremental_runs.run() == []
+
+
+def test_published_geometries_match_after_mapbox_round_trip(world, incremental_runs):
+    incremental_runs.run()
+    adm1_json = incremental_runs.global_layers["polbnda_adm1"]
+    adm1_json["geometry"] = adm1_json.geometry.apply(mapbox_round_trip)
+    adm1_json = adm1_json.iloc[::-1]
+    incremental_runs.global_layers["polbnda_adm1"] = adm1_json
+
+    assert incremental_runs.run() == []
+
+
+def test_changed_source_reprocessed(world, incremental_runs, monkeypatch):
+    incremental_runs.run()
+    iso = world["countries"][1]
+    incremental_runs.update_source(iso, monkeypatch)
+
+    assert incremental_runs.run() == [iso]
+    assert incremental_runs.manifest()[iso]["last_modified"] == "2022-06-01T00:00:00"
+    assert incremental_runs.run() == []
+
+
+def test_changed_published_features_reprocessed(world, incremental_runs):
+    incremental_runs.run()
+    iso = world["countries"][0]
+    adm1_json = incremental_runs.global_layers["polbnda_adm1"]
+    adm1_json = adm1_json[adm1_json["ADM1_PCODE"] != adm1_json["ADM1_PCODE"].iloc[0]]
+    incremental_runs.global_layers["polbnda_adm1"] = adm1_json
+
+    assert incremental_runs.run() == [iso]
+
+
+def test_interrupted_run_resumed(world, incremental_runs, monkeypatch):
+    incremental_runs.run()
+    manifest = incremental_runs.manifest()
+    iso = world["countries"][1]
+    incremental_runs.update_source(iso, monkeypatch)
+
+    # interrupted while processing countries, before the manifest is written
+    incremental_runs.interrupt_at = iso
+    with pytest.raises(KeyboardInterrupt):
+        incremental_runs.run()
+    assert incremental_runs.manifest() == manifest
+
+    # interrupted after the manifest is written, before the boundaries are published
+    incremental_runs.interrupt_at = None
+    with monkeypatch.context() as m:
+        m.setattr(BenchmarkResource, "update_in_hdx", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            incremental_runs.run()
+    assert incremental_runs.manifest()[iso]["last_modified"] == "2022-06-01T00:00:00"
+
+    assert incremental_runs.run() == [iso]
+    assert incremental_runs.run() == []
+
+
+def interrupt(*args):
+    raise KeyboardInterrupt
+
+
+def test_failed_country_dropped_from_manifest(world, incremental_runs):
+    iso = world["countries"][2]
+    incremental_runs.failing.add(iso)
+    assert incremental_runs.run() == world["countries"]
+    assert iso not in incremental_runs.manifest()
+
+    incremental_runs.failing.clear()
+    assert incremental_runs.run() == [iso]
+    assert iso in incremental_runs.manifest()
+    assert incremental_runs.run() == []
@@ -0,0 +1,67 @@
+from glob import glob
+from os.path import basename, join
+
+import pytest
+from geopandas import GeoDataFrame
+from geopandas.testing import assert_geodataframe_equal
+from shapely.geometry import MultiPolygon, Point, box
+
+from scrapers.utilities.cache_functions import (
+    read_cached_layer,
+    setup_cache,
+    write_cached_layer,
+)
+
+
+@pytest.fixture
+def cache_folder(tmp_path):
+    cache_folder = join(tmp_path, "cache")
+    setup_cache(cache_folder)
+    yield cache_folder
+    setup_cache(None)
+
+
+def boundaries(crs):
+    return GeoDataFrame(
+        {
+            "ADM1_PCODE": ["AF01", "AF02", "AF03"],
+            "ADM1_REF": ["Kabul", "Ségou", None],
+            "Population": [100, 2000, 30000],
+            "Area": [1.5, 2.25, 0.125],
+            "HRPs": [True, False, True],
+        },
+        geometry=[
+            box(0, 0, 1, 1),
+            MultiPolygon([box(2, 0, 3, 1), box(4, 0, 5, 1)]),
+            Point(6, 0).buffer(0.5),
+        ],
+        crs=crs,
+    )
+
+
+@pytest.mark.parametrize("crs", ["EPSG:4326", "EPSG:3857"])
+def test_cached_layer_round_trip(cache_folder, crs):
+    lyr = boundaries(crs)
+
+    write_cached_layer("boundaries-AFG", "v1", lyr)
+    cached = read_cached_layer("boundaries-AFG", "v1")
+
+    assert_geodataframe_equal(cached, lyr, check_less_precise=False)
+    assert cached.crs == lyr.crs
+    assert dict(cached.dtypes) == dict(lyr.dtypes)
+
+
+def test_cached_layer_keeps_latest_version(cache_folder):
+    write_cached_layer("boundaries-AFG", "v1", boundaries("EPSG:4326"))
+    write_cached_layer("boundaries-AFG", "v2", boundaries("EPSG:4326"))
+
+    assert read_cached_layer("boundaries-AFG", "v1") is None
+    assert read_cached_layer("boundaries-AFG", "v2") is not None
+    layer_files = glob(join(cache_folder, "layers", "*.parquet"))
+    assert [basename(f) for f in layer_files] == ["boundaries-AFG-v2.parquet"]
+
+
+def test_offline_run_does_not_write_layers(cache_folder):
+    setup_cache(cache_folder, offline=True)
+    write_cached_layer("boundaries-AFG", "v1", boundaries("EPSG:4326"))
+    assert read_cached_layer("boundaries-AFG", "v1") is None
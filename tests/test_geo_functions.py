@@ -0,0 +1,64 @@
+from geopandas import GeoDataFrame
+from pandas import concat
+from shapely.geometry import Polygon, box
+
+from scrapers.utilities.geo_functions import assign_slivers
+
+fields = ["alpha_3", "ADM1_PCODE"]
+
+
+def layer(geometries, pcodes=None):
+    lyr = GeoDataFrame(geometry=list(geometries))
+    if pcodes:
+        lyr["alpha_3"] = "AAA"
+        lyr["ADM1_PCODE"] = pcodes
+    return lyr
+
+
+# two units side by side, and a third above the right one with a gap below it
+units = layer([box(0, 0, 2, 2), box(2, 0, 4, 2), box(4, 2.2, 6, 3)], ["AA1", "AA2", "AA3"])
+
+
+def assigned_pcodes(slivers, units=units):
+    return list(assign_slivers(layer(slivers), units, fields)["ADM1_PCODE"])
+
+
+def test_sliver_goes_to_longest_shared_boundary():
+    # shares 0.5 along the top of AA1 and 1 along the top of AA2
+    assert assigned_pcodes([box(1.5, 2, 3, 2.2)]) == ["AA2"]
+    # shares 1.5 with AA1 and 1 with AA2
+    assert assigned_pcodes([box(0.5, 2, 3, 2.2)]) == ["AA1"]
+
+
+def test_tied_sliver_resolved_the_same_way_in_any_order():
+    # shares 1 with each of AA1 and AA2
+    sliver = box(1, 2, 3, 2.2)
+    assert assigned_pcodes([sliver]) == ["AA1"]
+    assert assigned_pcodes([sliver], units.iloc[::-1]) == ["AA1"]
+    assert assigned_pcodes([sliver], units.iloc[[1, 2, 0]]) == ["AA1"]
+
+
+def test_point_contact_is_not_a_shared_boundary():
+    # touches AA2 only at its corner (4, 2), and shares a very short edge with AA3
+    sliver = Polygon([(4, 2), (4.5, 2.1), (4.001, 2.2), (4, 2.2)])
+    assert assigned_pcodes([sliver]) == ["AA3"]
+    # a sliver that only touches a unit at a point still goes to that unit
+    assert assigned_pcodes([Polygon([(6, 3), (7, 4), (7, 3.5)])]) == ["AA3"]
+
+
+def test_each_sliver_assigned_once():
+    slivers = [
+        box(1.5, 2, 3, 2.2),
+        box(1, 2, 3, 2.2),
+        box(0, -0.1, 4, 0),
+        box(4, 0, 4.1, 2.2),
+        box(10, 10, 11, 11),
+    ]
+
+    assigned = assign_slivers(layer(slivers), units, fields)
+
+    # every sliver touching a unit is kept once, and one touching nothing is left out
+    assert len(assigned.index) == 4
+    assert assigned.geometry.area.sum() == sum(s.area for s in slivers[:4])
+    harmonized = concat([units, assigned]).dissolve(by=fields, as_index=False)
+    assert sorted(harmonized["ADM1_PCODE"]) == ["AA1", "AA2", "AA3"]
@@ -0,0 +1,213 @@
+from glob import glob
+from os.path import basename, exists, join
+from time import sleep
+from zipfile import ZipFile
+
+import pytest
+from geopandas import GeoDataFrame
+from pandas import DataFrame, read_csv
+from shapely.geometry import Point
+
+from hdx.data.resource import Resource
+from hdx.utilities.downloader import DownloadError
+from scrapers.utilities import report_functions
+from scrapers.utilities.cache_functions import setup_cache
+from scrapers.utilities.hdx_functions import (
+    download_unzip_read_data,
+    find_resource,
+    get_tabular_rows,
+    prefetch,
+    prefetch_resource,
+    read_vector,
+    remove_unzipped_download,
+    reset_dataset_lookups,
+    update_csv_resource,
+)
+from scrapers.utilities.report_functions import pop_report_stages, set_report_context
+
+population_csv = "ADM1_PCODE,Population\nAF01,100\nAF02,200\n"
+
+
+def test_online_run_reads_from_hdx(local_hdx, downloader):
+    local_hdx.add_resource("cod-ps-afg", "afg_adm1_pop.csv", "CSV", population_csv)
+
+    resource = find_resource("cod-ps-afg", "csv", kw="adm1")
+    headers, rows = get_tabular_rows(downloader, resource[0])
+
+    assert headers == ["ADM1_PCODE", "Population"]
+    assert [row["Population"] for row in rows] == ["100", "200"]
+    assert local_hdx.calls == [("dataset", "cod-ps-afg")]
+
+
+def test_offline_run_reads_from_cache(local_hdx, downloader, tmp_path):
+    local_hdx.add_resource("cod-ps-afg", "afg_adm1_pop.csv", "CSV", population_csv)
+    cache_folder = join(tmp_path, "cache")
+    setup_cache(cache_folder)
+    resource = find_resource("cod-ps-afg", "csv", kw="adm1")
+    _, rows = get_tabular_rows(downloader, resource[0])
+    online_rows = list(rows)
+    assert local_hdx.calls == [("dataset", "cod-ps-afg"), ("resource", "afg_adm1_pop.csv")]
+
+    local_hdx.calls.clear()
+    reset_dataset_lookups()
+    setup_cache(cache_folder, offline=True)
+    resource = find_resource("cod-ps-afg", "csv", kw="adm1")
+    _, rows = get_tabular_rows(downloader, resource[0])
+
+    assert list(rows) == online_rows
+    assert local_hdx.calls == []
+
+
+def test_offline_run_without_cached_copy_fails(local_hdx, downloader, tmp_path):
+    resource = local_hdx.add_resource("cod-ps-afg", "afg_adm1_pop.csv", "CSV", population_csv)
+    setup_cache(join(tmp_path, "cache"), offline=True)
+
+    assert find_resource("cod-ps-afg", "csv") is None
+    with pytest.raises(DownloadError):
+        get_tabular_rows(downloader, Resource(resource))
+    assert local_hdx.calls == []
+
+
+@pytest.fixture
+def points_zip(tmp_path):
+    # 20 points along a line, half of them inside the bbox (4.5, -1, 14.5, 1)
+    points = GeoDataFrame(
+        {"name": [f"hf{i}" for i in range(20)], "beds": list(range(20))},
+        geometry=[Point(i, 0) for i in range(20)],
+        crs="EPSG:4326",
+    )
+    points.to_file(join(tmp_path, "health_points.shp"))
+    zip_file = join(tmp_path, "health_points.zip")
+    with ZipFile(zip_file, "w") as z:
+        for path in glob(join(tmp_path, "health_points.*")):
+            if not path.endswith(".zip"):
+                z.write(path, basename(path))
+    return zip_file
+
+
+def test_read_vector_chunks_match_whole_read(points_zip):
+    path = f"zip://{points_zip}!health_points.shp"
+    bbox = (4.5, -1, 14.5, 1)
+
+    whole = read_vector(path, columns=["name"], bbox=bbox)
+    chunks = list(read_vector(path, columns=["name"], bbox=bbox, chunk_size=4))
+
+    assert [len(chunk.index) for chunk in chunks] == [4, 4, 2]
+    assert all(list(chunk.columns) == ["name", "geometry"] for chunk in chunks)
+    assert [n for chunk in chunks for n in chunk["name"]] == list(whole["name"])
+    assert list(whole["name"]) == [f"hf{i}" for i in range(5, 15)]
+    assert chunks[0].crs == whole.crs
+
+
+def test_read_vector_chunks_without_trailing_empty_chunk(points_zip):
+    path = f"zip://{points_zip}!health_points.shp"
+    chunks = list(read_vector(path, chunk_size=5))
+    assert [len(chunk.index) for chunk in chunks] == [5, 5, 5, 5]
+
+
+def test_chunked_read_removes_download(local_hdx, points_zip):
+    with open(points_zip, "rb") as f:
+        content = f.read()
+    resource = local_hdx.add_resource("hotosm_afg_health_facilities", "points.zip", "SHP", "")
+    with open(resource["url"], "wb") as f:
+        f.write(content)
+
+    chunks = download_unzip_read_data(
+        Resource(resource), "shp", unzip=True, read=True, columns=[], chunk_size=8
+    )
+    downloaded = join(local_hdx.folder, "downloads", "points.zip")
+    assert [len(chunk.index) for chunk in chunks] == [8, 8, 4]
+    assert not exists(downloaded)
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_unzipped_download_removed_once_read(local_hdx, points_zip, tmp_path, cached):
+    if cached:
+        setup_cache(join(tmp_path, "cache"))
+    with open(points_zip, "rb") as f:
+        content = f.read()
+    resource = local_hdx.add_resource("cod-ab-afg", "afg_adm_shp.zip", "SHP", "")
+    with open(resource["url"], "wb") as f:
+        f.write(content)
+
+    out_files = download_unzip_read_data(Resource(resource), "shp", unzip=True)
+    zip_file = out_files[0][len("zip://"):].split("!")[0]
+    assert len(read_vector(out_files[0]).index) == 20
+
+    remove_unzipped_download(out_files)
+    assert exists(zip_file) == cached
+
+
+@pytest.mark.parametrize(
+    "existing_csv",
+    [
+        "alpha_3,ADM1_PCODE,Population,source\nAFG,AF01,1,a\nAFG,AF02,2,a\nBDI,BI01,3,b\nCAF,CF01,4,c\n",
+        "alpha_3,ADM1_PCODE,Population,source\nCAF,CF01,4,c\nAFG,AF02,2,a\nBDI,BI01,3,b\nAFG,AF01,1,a\n",
+    ],
+    ids=["sorted", "unsorted"],
+)
+def test_update_csv_resource_replaces_countries_in_pcode_order(
+    local_hdx, downloader, tmp_path, existing_csv
+):
+    resource = local_hdx.add_resource("population", "population.csv", "CSV", existing_csv)
+    new_data = DataFrame(
+        {
+            "alpha_3": ["BDI", "BDI", "AFG"],
+            "ADM1_PCODE": ["BI02", "BI01", "AF03"],
+            "Population": [30, 20, 5],
+        }
+    )
+    out_file = join(tmp_path, "population_by_adm1.csv")
+
+    assert update_csv_resource(Resource(resource), downloader, new_data, ["BDI"], out_file) == out_file
+
+    rows = read_csv(out_file, dtype=str, keep_default_na=False)
+    assert list(rows.columns) == ["alpha_3", "ADM1_PCODE", "Population", "source"]
+    assert rows.values.tolist() == [
+        ["AFG", "AF01", "1", "a"],
+        ["AFG", "AF02", "2", "a"],
+        ["BDI", "BI01", "20", ""],
+        ["BDI", "BI02", "30", ""],
+        ["CAF", "CF01", "4", "c"],
+    ]
+
+
+def fetch_or_fail(iso):
+    if iso == "BDI":
+        raise ValueError("no data")
+    return iso.lower()
+
+
+@pytest.mark.parametrize("depth", [0, 2])
+def test_prefetch_hands_failed_items_back_as_none(depth):
+    fetched = list(prefetch(["AFG", "BDI", "CAF"], fetch_or_fail, depth))
+    assert fetched == [("AFG", "afg"), ("BDI", None), ("CAF", "caf")]
+
+
+def test_prefetched_download_is_recorded_by_fetch_thread(local_hdx, monkeypatch):
+    monkeypatch.setitem(report_functions._report, "enabled", True)
+    pop_report_stages()
+    resources = {
+        iso: Resource(local_hdx.add_resource(f"worldpop-{iso}", f"{iso}.tif", "GeoTIFF", iso))
+        for iso in ["AFG", "BDI"]
+    }
+    download = local_hdx.download
+
+    def slow_download(resource, folder=None):
+        sleep(0.05)
+        return download(resource, folder)
+
+    monkeypatch.setattr(local_hdx, "download", slow_download)
+    set_report_context(scraper="population", country=None)
+
+    for iso, resource_file in prefetch(resources, lambda iso: prefetch_resource(resources[iso])):
+        set_report_context(country=iso)
+        assert download_unzip_read_data(resources[iso]) == [resource_file]
+
+    # each download is recorded once, with its time spent in the fetch thread
+    stages = pop_report_stages()
+    assert sorted((s["stage"], s["scraper"], s["country"]) for s in stages) == [
+        ("download", "population", "AFG"),
+        ("download", "population", "BDI"),
+    ]
+    assert all(s["bytes_out"] == 3 and s["wall_time"] >= 0.05 for s in stages)
@@ -0,0 +1,109 @@
+from glob import glob
+from os import makedirs
+from os.path import basename, join
+from zipfile import ZipFile
+
+import pytest
+from geopandas import GeoDataFrame
+from pandas import DataFrame, read_csv
+from shapely.geometry import Point, box
+
+from hdx.data.resource import Resource
+from scrapers.health_facilities import update_health_facilities
+
+# three selected countries side by side, one with a unit to the north of the others, and one
+# country that is not selected
+adm1_rows = [
+    ("AAA", "AAA1", box(0, 0, 1, 1)),
+    ("AAA", "AAA2", box(1, 0, 2, 1)),
+    ("BBB", "BBB1", box(2, 0, 3, 1)),
+    ("CCC", "CCC1", box(0, 1, 3, 2)),
+    ("DDD", "DDD1", box(5, 0, 6, 1)),
+]
+countries = ["AAA", "BBB", "CCC"]
+
+points = {
+    # two in AAA1 and two in AAA2, one on the border of AAA2 and BBB1, one just inside BBB1, one
+    # just inside CCC1, one in the country that is not selected and one outside every unit
+    "AAA": [(0.5, 0.5), (0.6, 0.5), (1.5, 0.5), (1.6, 0.5), (2.0, 0.8), (2.05, 0.5),
+            (0.5, 1.05), (5.5, 0.5), (9, 9)],
+    # three in BBB1 and one just inside AAA2
+    "BBB": [(2.5, 0.5), (2.6, 0.5), (2.7, 0.2), (1.95, 0.5)],
+    # CCC has no health facilities dataset
+}
+
+
+@pytest.fixture
+def adm1_json():
+    return GeoDataFrame(
+        {
+            "alpha_3": [iso for iso, _, _ in adm1_rows],
+            "ADM0_REF": [iso.title() for iso, _, _ in adm1_rows],
+            "ADM0_PCODE": [iso[:2] for iso, _, _ in adm1_rows],
+            "ADM1_REF": [pcode.title() for _, pcode, _ in adm1_rows],
+            "ADM1_PCODE": [pcode for _, pcode, _ in adm1_rows],
+        },
+        geometry=[geometry for _, _, geometry in adm1_rows],
+        crs="EPSG:4326",
+    )
+
+
+def add_points(local_hdx, tmp_path, iso):
+    name = f"hotosm_{iso.lower()}_health_facilities_points"
+    lyr = GeoDataFrame(
+        {"name": [f"hf{i}" for i in range(len(points[iso]))]},
+        geometry=[Point(xy) for xy in points[iso]],
+        crs="EPSG:4326",
+    )
+    lyr.to_file(join(tmp_path, f"{name}.shp"))
+    resource = local_hdx.add_resource(
+        f"hotosm_{iso.lower()}_health_facilities", f"{name}_shp.zip", "SHP", ""
+    )
+    with ZipFile(resource["url"], "w") as z:
+        for path in glob(join(tmp_path, f"{name}.*")):
+            z.write(path, basename(path))
+
+
+def per_country_counts(adm1_json):
+    # the original loop: join each country's points to every selected unit, writing each count
+    # over any earlier one
+    adm1_lyr = adm1_json[adm1_json["alpha_3"].isin(countries)].copy()
+    adm1_lyr["Health_Facilities"] = None
+    for iso in countries:
+        if iso not in points:
+            continue
+        health_lyr = GeoDataFrame(geometry=[Point(xy) for xy in points[iso]], crs="EPSG:4326")
+        join_lyr = DataFrame(health_lyr.sjoin(adm1_lyr)).groupby("ADM1_PCODE").size()
+        for pcode in join_lyr.index:
+            adm1_lyr.loc[adm1_lyr["ADM1_PCODE"] == pcode, "Health_Facilities"] = join_lyr[pcode]
+    return dict(zip(adm1_lyr["ADM1_PCODE"], adm1_lyr["Health_Facilities"]))
+
+
+@pytest.mark.parametrize("chunk_size", [None, 2])
+def test_counts_match_country_by_country_join(
+    local_hdx, downloader, adm1_json, tmp_path, monkeypatch, chunk_size
+):
+    for iso in points:
+        add_points(local_hdx, tmp_path, iso)
+    local_hdx.add_resource(
+        "health", "health_facilities_by_adm1.csv", "CSV", "alpha_3,ADM1_PCODE,Health_Facilities\n"
+    )
+    uploads = list()
+    monkeypatch.setattr(Resource, "update_in_hdx", lambda self: uploads.append(self.file_to_upload))
+    configuration = {
+        "prefetch": {"countries": 0, "disk_budget_mb": None},
+        "health_facilities": {"dataset": "health", "chunk_size": chunk_size},
+    }
+    temp_folder = join(tmp_path, "temp")
+    makedirs(temp_folder)
+
+    assert update_health_facilities(
+        configuration, downloader, countries, adm1_json, temp_folder
+    ) is True
+
+    rows = read_csv(uploads[0], dtype=str)
+    counts = dict(zip(rows["ADM1_PCODE"], rows["Health_Facilities"].astype(int)))
+    assert counts == per_country_counts(adm1_json)
+    # later countries' counts replace earlier ones, and a country without points of its own is
+    # counted from its neighbours' points
+    assert counts == {"AAA1": 2, "AAA2": 1, "BBB1": 3, "CCC1": 1}
@@ -0,0 +1,122 @@
+from threading import Lock
+
+from loguru import logger as loguru_logger
+
+from scrapers import main
+from scrapers.main import get_indicators, log_scraper_names, run_tasks
+from scrapers.utilities.hdx_functions import prefetch
+from scrapers.utilities.report_functions import get_report_context
+
+
+def task(run, inputs, outputs):
+    return {"run": run, "inputs": inputs, "outputs": outputs}
+
+
+def test_tasks_only_succeed_when_they_return_true():
+    ran = list()
+
+    def run(name, result):
+        def run_task():
+            ran.append(name)
+            return result
+
+        return run_task
+
+    tasks = {
+        "layer": task(run("layer", True), [], ["layer"]),
+        "no status": task(run("no status", None), ["layer"], ["no status"]),
+        "after no status": task(run("after no status", True), ["no status"], []),
+        "fails": task(run("fails", False), ["layer"], ["fails"]),
+        "after fails": task(run("after fails", True), ["fails"], []),
+        "succeeds": task(run("succeeds", True), ["layer"], []),
+    }
+
+    assert run_tasks(tasks, workers=3) == {"layer", "succeeds"}
+    assert sorted(ran) == ["fails", "layer", "no status", "succeeds"]
+
+
+def test_log_lines_name_the_scraper_running():
+    def run(name):
+        def run_task():
+            loguru_logger.info(f"Updated {name}")
+            return True
+
+        return run_task
+
+    records = list()
+    # added before the scraper names are set up, as hdx adds its error log file
+    sink = loguru_logger.add(records.append, format="{extra[scraper]} {message}")
+    try:
+        log_scraper_names()
+        run_tasks(
+            {
+                "population": task(run("population"), [], []),
+                "health_facilities": task(run("health_facilities"), [], []),
+            },
+            workers=2,
+        )
+    finally:
+        loguru_logger.remove(sink)
+
+    assert sorted(record.record["message"] for record in records) == [
+        "Updated health_facilities",
+        "Updated population",
+    ]
+    assert sorted(records) == [
+        "health_facilities Updated health_facilities\n",
+        "population Updated population\n",
+    ]
+
+
+def test_scrapers_run_in_their_own_context(monkeypatch):
+    contexts = dict()
+    lock = Lock()
+
+    def record(name):
+        with lock:
+            contexts.setdefault(name, set()).add(get_report_context("scraper"))
+
+    def scraper(name):
+        def update(*args):
+            record(name)
+            # threads started by a scraper work in its context
+            for _, _ in prefetch(["AFG", "BDI"], lambda iso: record(f"{name} prefetch")):
+                pass
+            return True
+
+        return update
+
+    def download_from_mapbox(mapid, mapbox_auth):
+        record(mapid)
+        return mapid
+
+    for name in ["un_boundaries", "boundaries", "population", "health_facilities"]:
+        monkeypatch.setattr(main, f"update_{name}", scraper(name))
+    monkeypatch.setattr(main, "download_from_mapbox", download_from_mapbox)
+    layer_names = ["polbnda_adm1"] + main.boundaries_layers
+    configuration = {
+        "adm1": {"explorer": ["AFG", "BDI"]},
+        "mapbox": {"global": {name: name for name in layer_names}},
+    }
+
+    get_indicators(
+        configuration,
+        None,
+        None,
+        None,
+        "mapbox",
+        False,
+        ["un_boundaries", "boundaries", "population", "health_facilities"],
+    )
+
+    assert contexts == {
+        "un_boundaries": {"un_boundaries"},
+        "un_boundaries prefetch": {"un_boundaries"},
+        "boundaries": {"boundaries"},
+        "boundaries prefetch": {"boundaries"},
+        "population": {"population"},
+        "population prefetch": {"population"},
+        "health_facilities": {"health_facilities"},
+        "health_facilities prefetch": {"health_facilities"},
+        **{name: {"global_layers"} for name in layer_names},
+    }
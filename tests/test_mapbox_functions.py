@@ -0,0 +1,213 @@
+from base64 import b64encode
+from json import dump, dumps
+from os.path import join
+from threading import BoundedSemaphore, Lock, Thread, current_thread
+from time import sleep
+
+import pytest
+from mapbox import Datasets
+
+from scrapers.utilities import mapbox_functions
+from scrapers.utilities.mapbox_functions import (
+    download_from_mapbox,
+    list_mapbox_features,
+    replace_mapbox_dataset,
+)
+
+# mapbox reads the username from the token
+token = "pk.{}.signature".format(b64encode(dumps({"u": "test"}).encode("utf-8")).decode("utf-8"))
+
+
+class Response:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class MapboxSession:
+    # stand-in for the Mapbox datasets API, keeping features in the order they were added
+    def __init__(self, features, delay=0):
+        self.params = {"access_token": token}
+        self.features = {f["id"]: f for f in features}
+        self.delay = delay
+        self.pages = list()
+        self.sent = list()
+        self.sending_threads = set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = Lock()
+
+    def get(self, uri, params=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        sleep(self.delay)
+        fids = list(self.features)
+        start = 0
+        if params.get("start"):
+            start = fids.index(params["start"]) + 1
+        page = [self.features[fid] for fid in fids[start:start + params["limit"]]]
+        with self.lock:
+            self.pages.append((params.get("start"), len(page)))
+            self.active -= 1
+        return Response(200, {"type": "FeatureCollection", "features": page})
+
+    def put(self, uri, json=None):
+        fid = uri.split("/")[-1]
+        with self.lock:
+            self.sent.append(("update", fid))
+            self.sending_threads.add(current_thread().name)
+            self.features[fid] = dict(json, id=fid)
+        return Response(200)
+
+    def delete(self, uri):
+        fid = uri.split("/")[-1]
+        with self.lock:
+            self.sent.append(("delete", fid))
+            self.sending_threads.add(current_thread().name)
+            self.features.pop(fid)
+        return Response(204)
+
+
+def make_features(count):
+    return [
+        {
+            "type": "Feature",
+            "id": str(i + 1),
+            "properties": {"ADM1_PCODE": f"AF{i + 1:03d}"},
+            "geometry": {"type": "Point", "coordinates": [float(i), 0.0]},
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def client_threads():
+    return list()
+
+
+@pytest.fixture
+def mapbox_session(monkeypatch, client_threads):
+    sessions = list()
+
+    def datasets(access_token=None):
+        client_threads.append(current_thread().name)
+        datasets = Datasets(access_token=token)
+        datasets.session = sessions[0]
+        return datasets
+
+    monkeypatch.setattr(mapbox_functions, "Datasets", datasets)
+    return sessions
+
+
+def test_list_features_pages_until_short_page():
+    datasets = Datasets(access_token=token)
+    datasets.session = MapboxSession(make_features(250))
+
+    pages = list(list_mapbox_features(datasets, "adm1", page_size=100))
+
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert datasets.session.pages == [(None, 100), ("100", 100), ("200", 50)]
+
+
+def test_list_features_stops_after_empty_page():
+    datasets = Datasets(access_token=token)
+    datasets.session = MapboxSession(make_features(200))
+
+    pages = list(list_mapbox_features(datasets, "adm1", page_size=100))
+
+    assert [len(page) for page in pages] == [100, 100]
+    assert datasets.session.pages == [(None, 100), ("100", 100), ("200", 0)]
+
+
+def test_list_features_stops_on_error():
+    datasets = Datasets(access_token=token)
+    datasets.session.get = lambda uri, params=None: Response(404)
+
+    assert list(list_mapbox_features(datasets, "adm1")) == [None]
+
+
+def test_download_keeps_features_in_id_order(mapbox_session):
+    features = make_features(250)
+    mapbox_session.append(MapboxSession(features[100:] + features[:100]))
+
+    lyr = download_from_mapbox("adm1", token)
+
+    assert list(lyr["ADM1_PCODE"]) == [f"AF{i + 1:03d}" for i in range(250)]
+    assert len(mapbox_session[0].pages) == 3
+
+
+def test_downloads_share_request_limit(mapbox_session, monkeypatch):
+    monkeypatch.setattr(mapbox_functions, "mapbox_requests", BoundedSemaphore(2))
+    mapbox_session.append(MapboxSession(make_features(500), delay=0.02))
+
+    threads = [Thread(target=download_from_mapbox, args=("adm1", token)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(mapbox_session[0].pages) == 6 * 6
+    assert mapbox_session[0].max_active == 2
+
+
+def square(pcode, x, fid=None, start=0, noise=0.0):
+    ring = [[x, 0.0], [x + 1, 0.0], [x + 1, 1.0], [x, 1.0]]
+    ring = ring[start:] + ring[:start]
+    ring = [[cx + noise, cy + noise] for cx, cy in ring]
+    feature = {
+        "type": "Feature",
+        "properties": {"ADM1_PCODE": pcode, "ADM1_REF": pcode.lower()},
+        "geometry": {"type": "Polygon", "coordinates": [ring + [ring[0]]]},
+    }
+    if fid:
+        feature["id"] = fid
+    return feature
+
+
+def test_replace_dataset_only_sends_changed_features(mapbox_session, tmp_path):
+    session = MapboxSession(
+        [
+            square("AF01", 0, fid="1"),
+            square("AF02", 1, fid="2"),
+            square("AF03", 2, fid="3"),
+            square("AF04", 3, fid="4"),
+        ]
+    )
+    mapbox_session.append(session)
+    unchanged = square("AF01", 0, start=2, noise=1e-9)
+    reversed_ring = square("AF02", 1)
+    reversed_ring["geometry"]["coordinates"][0].reverse()
+    renamed = square("AF03", 2)
+    renamed["properties"]["ADM1_REF"] = "renamed"
+    added = square("AF05", 4)
+    upload_file = join(tmp_path, "adm1.geojson")
+    with open(upload_file, "w") as f:
+        dump({"type": "FeatureCollection", "features": [unchanged, reversed_ring, renamed, added]}, f)
+
+    replace_mapbox_dataset("adm1", token, path_to_upload=upload_file)
+
+    assert sorted(session.sent) == [("delete", "4"), ("update", "3"), ("update", "5")]
+    assert session.features["3"]["properties"]["ADM1_REF"] == "renamed"
+    assert session.features["5"]["properties"]["ADM1_PCODE"] == "AF05"
+    assert sorted(session.features) == ["1", "2", "3", "5"]
+
+
+def test_upload_threads_send_through_own_clients(mapbox_session, client_threads, tmp_path):
+    session = MapboxSession([square(f"AF{i:02d}", i, fid=str(i + 1)) for i in range(8)], delay=0.01)
+    mapbox_session.append(session)
+    upload_file = join(tmp_path, "adm1.geojson")
+    with open(upload_file, "w") as f:
+        dump({"type": "FeatureCollection", "features": [square("AF99", 20)]}, f)
+
+    replace_mapbox_dataset("adm1", token, path_to_upload=upload_file, workers=3)
+
+    assert len(session.sent) == 9
+    # one client lists the dataset, and each upload thread creates one of its own
+    assert client_threads[0] == current_thread().name
+    upload_threads = client_threads[1:]
+    assert len(set(upload_threads)) == len(upload_threads) == 3
+    assert session.sending_threads <= set(upload_threads)
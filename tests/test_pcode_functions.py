@@ -0,0 +1,76 @@
+from pandas import Series
+
+from scrapers.utilities.pcode_functions import (
+    build_pcodes,
+    build_sequential_pcodes,
+    find_attribute_fields,
+    normalize_names,
+)
+
+attribute_mappings = {
+    "pcode": ["ADM1_PCODE", "ADM1_ID", "ADMIN1PCOD"],
+    "name": ["ADM1_NAME", "ADM1_EN", "NAME_1"],
+}
+
+
+def test_find_attribute_fields_prefers_standard_fields():
+    fields = ["ADM1_ID", "ADM1_NAME", "ADM1_PCODE", "ADM1_EN"]
+    assert find_attribute_fields(fields, attribute_mappings) == ("ADM1_PCODE", "ADM1_EN")
+
+
+def test_find_attribute_fields_matches_mappings_in_any_case():
+    fields = ["OBJECTID", "admin1Pcod", "Name_1"]
+    assert find_attribute_fields(fields, attribute_mappings) == ("admin1Pcod", "Name_1")
+
+
+def test_find_attribute_fields_uses_first_mapped_field():
+    fields = ["ADM1_ID", "ADMIN1PCOD", "NAME_1", "ADM1_NAME"]
+    assert find_attribute_fields(fields, attribute_mappings) == ("ADM1_ID", "NAME_1")
+
+
+def test_find_attribute_fields_without_match():
+    fields = ["OBJECTID", "Shape_Area"]
+    assert find_attribute_fields(fields, attribute_mappings) == (None, None)
+
+
+def test_build_pcodes_pads_to_row_count():
+    adm0_pcodes = Series(["AF"] * 12, index=range(10, 22))
+    codes = Series([float(i) for i in range(1, 13)], index=range(10, 22))
+
+    pcodes = build_pcodes(adm0_pcodes, codes)
+
+    assert list(pcodes.index) == list(range(10, 22))
+    assert list(pcodes) == [f"AF{i:02d}" for i in range(1, 13)]
+
+
+def test_build_pcodes_keeps_codes_longer_than_padding():
+    pcodes = build_pcodes(Series(["BI", "BI"]), Series([7, 123]))
+    assert list(pcodes) == ["BI7", "BI123"]
+
+
+def test_build_pcodes_matches_row_by_row_loop():
+    adm0_pcodes = Series(["CF", "CF", "TD"] * 40)
+    codes = Series([(i * 37) % 150 + 1 for i in range(120)])
+    width = len(str(len(codes)))
+    expected = [a + str(int(c)).zfill(width) for a, c in zip(adm0_pcodes, codes)]
+    assert list(build_pcodes(adm0_pcodes, codes)) == expected
+
+
+def test_build_sequential_pcodes():
+    adm0_pcodes = Series(["ML"] * 10, index=list("abcdefghij"))
+
+    pcodes = build_sequential_pcodes(adm0_pcodes)
+
+    assert list(pcodes.index) == list("abcdefghij")
+    assert list(pcodes) == [f"ML{i:02d}" for i in range(1, 11)]
+
+
+def test_normalize_names():
+    names = Series(["Al-Hasakeh", "Ségou", "Cote d'Ivoire", "Tombali`", "Plain"])
+    assert list(normalize_names(names)) == [
+        "Al Hasakeh",
+        "Segou",
+        "Cote dIvoire",
+        "Tombali",
+        "Plain",
+    ]
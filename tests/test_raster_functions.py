@@ -0,0 +1,93 @@
+from os.path import join
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+from shapely.geometry import Polygon, box
+
+from scrapers.utilities.raster_functions import raster_pool, zonal_sums
+
+nodata = -1
+
+
+@pytest.fixture
+def raster_file(tmp_path):
+    # 48 x 40 one degree pixels in 16 pixel blocks, each pixel holding its row * 100 + column,
+    # with a block of nodata
+    values = np.add.outer(np.arange(40) * 100, np.arange(48)).astype("float32")
+    values[20:24, 30:34] = nodata
+    raster_file = join(tmp_path, "population.tif")
+    with rasterio.open(
+        raster_file,
+        "w",
+        driver="GTiff",
+        width=48,
+        height=40,
+        count=1,
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=from_origin(0, 40, 1, 1),
+        nodata=nodata,
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+    ) as dst:
+        dst.write(values, 1)
+    return raster_file
+
+
+polygons = {
+    "aligned": box(2, 30, 5, 32),
+    "across blocks": box(10, 10, 25, 30),
+    "with nodata": box(28, 14, 36, 22),
+    "over edge": box(44, 36, 52, 44),
+    "outside": box(60, 0, 70, 10),
+    "diagonal": Polygon([(3.3, 3.3), (20.7, 6.2), (9.1, 18.8)]),
+    "within a pixel": box(7.2, 7.2, 7.4, 7.4),
+}
+
+
+def test_zonal_sums_known_values(raster_file):
+    sums = zonal_sums([polygons["aligned"], polygons["outside"]], raster_file)
+
+    # rows 8 and 9 from the top, columns 2 to 4
+    assert sums[0] == sum(row * 100 + col for row in [8, 9] for col in [2, 3, 4])
+    assert sums[1] is None
+
+
+@pytest.mark.parametrize("all_touched", [False, True])
+def test_zonal_sums_match_rasterstats(raster_file, all_touched):
+    expected = zonal_stats(
+        list(polygons.values()), raster_file, stats="sum", all_touched=all_touched
+    )
+
+    sums = zonal_sums(polygons.values(), raster_file, all_touched=all_touched)
+
+    for name, stats, total in zip(polygons, expected, sums):
+        if stats["sum"] is None:
+            assert total is None, name
+        else:
+            assert total == pytest.approx(stats["sum"], rel=1e-6), name
+
+
+def test_zonal_sums_in_workers_match(raster_file):
+    serial = zonal_sums(polygons.values(), raster_file, all_touched=True)
+    assert zonal_sums(polygons.values(), raster_file, workers=2, all_touched=True) == serial
+
+
+def test_zonal_sums_reuse_pool_across_rasters(raster_file, tmp_path):
+    with rasterio.open(raster_file) as src:
+        profile = src.profile
+        values = src.read(1)
+    doubled_file = join(tmp_path, "doubled.tif")
+    with rasterio.open(doubled_file, "w", **profile) as dst:
+        dst.write(np.where(values == nodata, nodata, values * 2), 1)
+
+    with raster_pool(2) as pool:
+        sums = zonal_sums(polygons.values(), raster_file, workers=2, pool=pool)
+        doubled = zonal_sums(polygons.values(), doubled_file, workers=2, pool=pool)
+
+    assert sums == zonal_sums(polygons.values(), raster_file)
+    assert doubled == [total * 2 if total is not None else None for total in sums]